@@ -0,0 +1,92 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import math
+
+import numpy as np
+
+
+class AffineTransform:
+    """
+    2D affine transform as a 3x3 matrix, for column vectors (x, y, 1): a @ b
+    applies b then a. Immutable.
+    """
+
+    def __init__(self, matrix=None):
+        if matrix is None:
+            matrix = np.identity(3)
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+
+    @classmethod
+    def fromCoefficients(cls, a, b, c, d, e, f):
+        # x' = a * x + b * y + c
+        # y' = d * x + e * y + f
+        return cls([[a, b, c], [d, e, f], [0.0, 0.0, 1.0]])
+
+    @classmethod
+    def fromGeoTransform(cls, geoTransform):
+        # GDAL order
+        c, a, b, f, d, e = geoTransform
+        return cls.fromCoefficients(a, b, c, d, e, f)
+
+    @classmethod
+    def translation(cls, dx, dy):
+        return cls.fromCoefficients(1.0, 0.0, dx, 0.0, 1.0, dy)
+
+    @classmethod
+    def scaling(cls, sx, sy):
+        return cls.fromCoefficients(sx, 0.0, 0.0, 0.0, sy, 0.0)
+
+    @classmethod
+    def rotation(cls, degrees):
+        # counterclockwise for a y axis pointing up
+        radians = math.radians(degrees)
+        cos = math.cos(radians)
+        sin = math.sin(radians)
+        return cls.fromCoefficients(cos, -sin, 0.0, sin, cos, 0.0)
+
+    def __matmul__(self, other):
+        return AffineTransform(self.matrix @ other.matrix)
+
+    def compose(self, other):
+        # other applied first
+        return self @ other
+
+    def inverted(self):
+        return AffineTransform(np.linalg.inv(self.matrix))
+
+    def coefficients(self):
+        # (a, b, c, d, e, f): see fromCoefficients
+        (a, b, c), (d, e, f) = self.matrix[:2].tolist()
+        return a, b, c, d, e, f
+
+    def geoTransform(self):
+        # GDAL order
+        a, b, c, d, e, f = self.coefficients()
+        return c, a, b, f, d, e
+
+    def worldFile(self):
+        """
+        Coefficients of a world file (in the order of the file) for a
+        transform of pixel corner coordinates: world files reference the
+        center of the pixels
+        """
+        a, b, c, d, e, f = (self @ AffineTransform.translation(0.5, 0.5)).coefficients()
+        return a, d, b, e, c, f
+
+    def transformPoints(self, points):
+        # points: array of shape (n, 2) => transformed array of shape (n, 2)
+        points = np.asarray(points, dtype=np.float64)
+        return points @ self.matrix[:2, :2].T + self.matrix[:2, 2]
+
+    def transformPoint(self, x, y):
+        a, b, c, d, e, f = self.coefficients()
+        return a * x + b * y + c, d * x + e * y + f
@@ -0,0 +1,303 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import functools
+import os
+import re
+
+from PyQt5.QtWidgets import QProgressBar, QPushButton
+from qgis.core import Qgis, QgsApplication, QgsMessageLog, QgsTask
+
+from . import gdal_utils, utils
+from .freehandrastergeoreferencer_commands import (
+    ExportGeorefRasterCommand,
+    exportRaster,
+    isStreamable,
+)
+
+# {name}: name of the layer, {file}: name of the raster file without
+# extension, {index}: number of the layer in the batch (from 1). The
+# extension gives the format
+DEFAULT_TEMPLATE = "{file}_georeferenced.tif"
+
+
+def templateError(template):
+    """
+    Message if the template cannot give the file names ({foo}, unbalanced
+    braces...), None if valid
+    """
+    try:
+        # same types as the values of outputName
+        template.format(name="name", file="file", index=1)
+    except KeyError as ex:
+        return "Unknown field {%s} in the file name" % ex.args[0]
+    except (ValueError, IndexError, AttributeError) as ex:
+        return "Invalid file name: %s" % ex
+    return None
+
+
+def outputName(template, layer, index):
+    baseName, _ = os.path.splitext(os.path.basename(layer.filepath))
+    name = template.format(name=layer.name(), file=baseName, index=index)
+    # not allowed in file names
+    return re.sub(r'[\\/:*?"<>|]', "_", name)
+
+
+def uniquePath(path, index, usedPaths):
+    """
+    Path not used by another export of the batch (written at the same time):
+    suffixed with _<index> otherwise. Adds it to usedPaths
+    """
+    root, extension = os.path.splitext(path)
+    candidate = path
+    suffix = "_%d" % index
+    while os.path.normcase(candidate) in usedPaths:
+        candidate = root + suffix + extension
+        suffix += "_%d" % index
+    usedPaths.add(os.path.normcase(candidate))
+    return candidate
+
+
+def maxRunningExports():
+    """
+    Exports at the same time: one per core, and not more than the warpers
+    fit in the memory budget
+    """
+    count = os.cpu_count() or 1
+    maxBytes = (
+        utils.settingValue(utils.SETTING_MEMORY_BUDGET, utils.DEFAULT_MEMORY_BUDGET)
+        * 1024
+        * 1024
+    )
+    if maxBytes > 0:
+        count = min(count, maxBytes // gdal_utils.WARP_MEMORY)
+    return max(1, count)
+
+
+def failedNames(failures, maxNames=10):
+    names = [name for name, _ in failures]
+    if len(names) > maxNames:
+        names = names[:maxNames] + ["..."]
+    return ", ".join(names)
+
+
+class BatchItem:
+    """
+    Values of a layer for the batch, read when the batch is created: the
+    layer can be removed from the project during the export
+    """
+
+    def __init__(self, index, layerId, layerName):
+        self.index = index
+        self.layerId = layerId
+        self.layerName = layerName
+        self.rasterPath = None
+        self.parameters = None
+        # raised when read from the layer: reported when started
+        self.error = None
+
+
+class BatchExport:
+    """
+    Export of plugin layers to a directory, one background task per layer,
+    with an aggregated progress in the message bar. Failures are reported
+    per layer in the QGIS Message log.
+    """
+
+    def __init__(self, iface, layers, directory, template):
+        self.iface = iface
+        # for the world files
+        self.command = ExportGeorefRasterCommand(iface)
+        self.directory = directory
+        self.template = template
+        # normalized paths of the exports of the batch
+        self.usedPaths = set()
+        # not started yet
+        self.pending = [
+            self.batchItem(index, layer) for index, layer in enumerate(layers, 1)
+        ]
+        self.total = len(self.pending)
+        self.maxRunning = maxRunningExports()
+        # layer id => task
+        self.tasks = {}
+        # layer id => progress of the running task (0 to 100)
+        self.progress = {}
+        self.finishedCount = 0
+        # (layer name, message)
+        self.failures = []
+        self.messageItem = None
+        self.progressBar = None
+
+    def batchItem(self, index, layer):
+        item = BatchItem(index, layer.id(), layer.name())
+        try:
+            rasterPath = os.path.join(
+                self.directory, outputName(self.template, layer, index)
+            )
+            item.rasterPath = uniquePath(rasterPath, index, self.usedPaths)
+            if not isStreamable(layer):
+                raise RuntimeError(
+                    "Raster not read by GDAL as displayed: export it from the dialog"
+                )
+            item.parameters = self.command.exportParameters(
+                layer, item.rasterPath, False
+            )
+        except Exception as ex:
+            item.error = ex
+        return item
+
+    def isRunning(self):
+        return self.finishedCount < self.total
+
+    def start(self):
+        self.messageItem = self.iface.messageBar().createMessage(
+            "Batch export", "Exporting %d rasters" % self.total
+        )
+        # can be closed by the user during the export
+        self.messageItem.destroyed.connect(self.messageItemDestroyed)
+        self.progressBar = QProgressBar()
+        self.progressBar.setRange(0, 100)
+        self.messageItem.layout().addWidget(self.progressBar)
+        cancelButton = QPushButton("Cancel")
+        cancelButton.clicked.connect(self.cancel)
+        self.messageItem.layout().addWidget(cancelButton)
+        self.iface.messageBar().pushWidget(self.messageItem, Qgis.Info)
+
+        self.startNext()
+
+    def messageItemDestroyed(self):
+        self.messageItem = None
+        self.progressBar = None
+
+    def startNext(self):
+        while self.pending and len(self.tasks) < self.maxRunning:
+            item = self.pending.pop(0)
+            try:
+                self.startItem(item)
+            except Exception as ex:
+                self.recordResult(item, ex)
+        self.updateProgress()
+        if not self.isRunning():
+            self.finished()
+
+    def startItem(self, item):
+        if item.error is not None:
+            raise item.error
+
+        parameters = item.parameters
+        if parameters.rasterFormat == "vrt":
+            # immediate
+            gdal_utils.georeferenced_vrt(
+                parameters.filepath,
+                parameters.geoTransform,
+                parameters.wkt,
+                path=item.rasterPath,
+            )
+            self.recordResult(item, None, ())
+            return
+
+        task = QgsTask.fromFunction(
+            "Exporting %s" % item.layerName,
+            exportRaster,
+            parameters,
+            on_finished=functools.partial(self.layerFinished, item),
+        )
+        task.progressChanged.connect(
+            functools.partial(self.layerProgressChanged, item.layerId)
+        )
+        self.tasks[item.layerId] = task
+        self.progress[item.layerId] = 0
+        QgsApplication.taskManager().addTask(task)
+
+    def layerRemoved(self, layerId):
+        # not exported if not started yet (the running exports use the values
+        # read when the batch was created)
+        removed = [item for item in self.pending if item.layerId == layerId]
+        for item in removed:
+            self.pending.remove(item)
+            self.recordResult(item, RuntimeError("Layer removed from the project"))
+        if removed:
+            self.startNext()
+
+    def layerProgressChanged(self, layerId, progress):
+        if layerId in self.progress:
+            self.progress[layerId] = progress
+            self.updateProgress()
+
+    def layerFinished(self, item, exception, worldFile=None):
+        del self.tasks[item.layerId]
+        del self.progress[item.layerId]
+        self.recordResult(item, exception, worldFile)
+        self.startNext()
+
+    def recordResult(self, item, exception, worldFile=None):
+        self.finishedCount += 1
+        if exception is None and worldFile is None:
+            exception = RuntimeError("Cancelled")
+
+        if exception is None:
+            try:
+                if utils.imageFormat(item.rasterPath) not in ("tif", "vrt"):
+                    # georeferencing not embedded
+                    self.command.writeWorldFile(item.rasterPath, worldFile)
+            except Exception as ex:
+                exception = ex
+        if exception is not None:
+            self.failures.append((item.layerName, str(exception)))
+            QgsMessageLog.logMessage(
+                "Batch export of %s failed: %r" % (item.layerName, exception)
+            )
+
+    def updateProgress(self):
+        if self.progressBar is None:
+            return
+        done = 100 * self.finishedCount + sum(self.progress.values())
+        self.progressBar.setValue(int(done / max(1, self.total)))
+
+    def cancel(self):
+        # the running tasks finish as cancelled
+        for item in self.pending:
+            self.failures.append((item.layerName, "Cancelled"))
+        self.finishedCount += len(self.pending)
+        self.pending = []
+        for task in list(self.tasks.values()):
+            task.cancel()
+        self.startNext()
+
+    def finished(self):
+        messageBar = self.iface.messageBar()
+        if self.messageItem is not None:
+            messageBar.popWidget(self.messageItem)
+            self.messageItem = None
+            self.progressBar = None
+
+        exported = self.total - len(self.failures)
+        if self.failures:
+            messageBar.pushMessage(
+                "Batch export",
+                "%d of %d rasters exported to %s. Failed: %s. "
+                "See QGIS Message log for details."
+                % (
+                    exported,
+                    self.total,
+                    self.directory,
+                    failedNames(self.failures),
+                ),
+                Qgis.Warning,
+                0,
+            )
+        else:
+            messageBar.pushMessage(
+                "Batch export",
+                "%d rasters exported to %s." % (exported, self.directory),
+                Qgis.Info,
+                5,
+            )
@@ -0,0 +1,191 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import hashlib
+import os
+import struct
+import uuid
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+from . import utils
+
+# magic, version, width, height, bytes per line, QImage format, flags
+HEADER = struct.Struct("<4sHIIIII")
+MAGIC = b"FRGC"
+VERSION = 1
+FLAG_TRANSFORMED = 1
+EXTENSION = ".raw"
+# bytes written at a time, from the buffer of the image (no copy in full)
+WRITE_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def decodedCacheFromSettings():
+    """
+    None if the cache is not enabled
+    """
+    directory = utils.settingValue(
+        utils.SETTING_DECODED_CACHE_DIR, utils.DEFAULT_DECODED_CACHE_DIR
+    )
+    if not directory:
+        return None
+    maxSize = utils.settingValue(
+        utils.SETTING_DECODED_CACHE_SIZE, utils.DEFAULT_DECODED_CACHE_SIZE
+    )
+    return DecodedCache(directory, maxSize * 1024 * 1024)
+
+
+class DecodedCache:
+    """
+    Directory of decoded images (raw pixels with a small header), so a raster
+    opened again is memory-mapped instead of being decoded. Entries are keyed
+    by the path, size and modification time of the raster file, plus the
+    display options. The oldest used entries are removed above maxSize.
+    """
+
+    def __init__(self, directory, maxSize):
+        # maxSize in bytes
+        self.directory = directory
+        self.maxSize = maxSize
+
+    def entryPath(self, filepath, options):
+        stat = os.stat(filepath)
+        key = "|".join(
+            [
+                os.path.abspath(filepath),
+                str(stat.st_size),
+                str(stat.st_mtime_ns),
+                repr(options.bands),
+                repr(options.percentClip),
+            ]
+        )
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name + EXTENSION)
+
+    def get(self, filepath, options):
+        """
+        (image, buffer, isTransformed) with the image memory-mapped from the
+        cache entry (the image does not own the buffer). None if not in cache
+        """
+        try:
+            path = self.entryPath(filepath, options)
+            with open(path, "rb") as f:
+                header = f.read(HEADER.size)
+        except OSError:
+            return None
+        if len(header) != HEADER.size:
+            return None
+        magic, version, width, height, bytesPerLine, format_, flags = HEADER.unpack(
+            header
+        )
+        if magic != MAGIC or version != VERSION:
+            return None
+
+        try:
+            # copy on write: QImage needs a writable buffer
+            buffer = np.memmap(
+                path,
+                dtype=np.uint8,
+                mode="c",
+                offset=HEADER.size,
+                shape=(height, bytesPerLine),
+            )
+        except (OSError, ValueError):
+            # truncated
+            return None
+        try:
+            # for the LRU eviction
+            os.utime(path)
+        except OSError:
+            pass
+
+        image = QImage(buffer, width, height, bytesPerLine, QImage.Format(format_))
+        return image, buffer, bool(flags & FLAG_TRANSFORMED)
+
+    def put(self, filepath, options, image, isTransformed):
+        if image.isNull():
+            return
+        if image.colorCount() > 0:
+            # color table not stored
+            image = image.convertToFormat(QImage.Format_ARGB32)
+        header = HEADER.pack(
+            MAGIC,
+            VERSION,
+            image.width(),
+            image.height(),
+            image.bytesPerLine(),
+            int(image.format()),
+            FLAG_TRANSFORMED if isTransformed else 0,
+        )
+        if HEADER.size + image.byteCount() > self.maxSize:
+            return
+
+        path = self.entryPath(filepath, options)
+        # written under another name first: other loadings may read the
+        # cache at the same time
+        tmpPath = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmpPath, "wb") as f:
+                f.write(header)
+                bits = image.constBits()
+                bits.setsize(image.byteCount())
+                pixels = memoryview(bits)
+                for offset in range(0, len(pixels), WRITE_CHUNK_SIZE):
+                    f.write(pixels[offset : offset + WRITE_CHUNK_SIZE])
+            os.replace(tmpPath, path)
+        except OSError:
+            try:
+                os.remove(tmpPath)
+            except OSError:
+                pass
+            return
+
+        self.evict()
+
+    def entries(self):
+        # (last use, size, path) of the cache entries
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(EXTENSION):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.maxSize:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # may be used by another QGIS
+                continue
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
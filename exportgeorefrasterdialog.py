@@ -13,6 +13,7 @@ import os.path
 
 from PyQt5.QtWidgets import QDialog, QFileDialog, QMessageBox
 
+from . import gdal_utils, utils
 from .ui_exportgeorefrasterdialog import Ui_ExportGeorefRasterDialog
 
 
@@ -29,10 +30,34 @@ class ExportGeorefRasterDialog(QDialog, Ui_ExportGeorefRasterDialog):
         self.checkBoxRotationMode.setChecked(False)
         self.checkBoxRotationMode.setEnabled(True)
         self.checkBoxOnlyWorldFile.setChecked(False)
+        compressions = self.compressions(layer)
+        self.comboBoxCompression.clear()
+        self.comboBoxCompression.addItems(compressions)
+        compression = utils.settingValue(
+            utils.SETTING_EXPORT_COMPRESSION, utils.DEFAULT_EXPORT_COMPRESSION
+        )
+        if compression.upper() in compressions:
+            self.comboBoxCompression.setCurrentText(compression.upper())
+        self.spinBoxLevel.setValue(
+            utils.settingValue(utils.SETTING_EXPORT_LEVEL, utils.DEFAULT_EXPORT_LEVEL)
+        )
 
         defaultPath, _ = os.path.splitext(layer.filepath)
         self.defaultPath = defaultPath + "_georeferenced.png"
 
+    def compressions(self, layer):
+        # available in the GDAL build, JPEG only for the rasters it can encode
+        compressions = gdal_utils.gtiff_compressions()
+        format_ = gdal_utils.format(layer.getAbsoluteFilepath())
+        if format_ is not None:
+            # GeoTIFF exported with all the bands
+            nbands, datatype, _, _ = format_
+            if not gdal_utils.is_jpeg_compatible(datatype, nbands):
+                compressions = [
+                    compression for compression in compressions if compression != "JPEG"
+                ]
+        return compressions
+
     def setupOnlyWorldFile(self):
         if self.checkBoxOnlyWorldFile.isChecked():
             self._originalCheckBoxRotationModeChecked = (
@@ -58,7 +83,8 @@ class ExportGeorefRasterDialog(QDialog, Ui_ExportGeorefRasterDialog):
                 None,
                 "Export georeferenced raster",
                 filepathDialog,
-                "Images (*.png *.bmp *.jpg *.tif *.tiff)",
+                "Images (*.png *.bmp *.jpg *.tif *.tiff);;"
+                "GDAL virtual raster referencing the file (*.vrt)",
             )
         else:
             filepath, _ = QFileDialog.getOpenFileName(
@@ -99,13 +125,23 @@ class ExportGeorefRasterDialog(QDialog, Ui_ExportGeorefRasterDialog):
         if result:
             _, extension = os.path.splitext(self.imagePath)
             extension = extension.lower()
-            if extension not in [".jpg", ".bmp", ".png", ".tif", ".tiff"]:
+            if extension == ".vrt":
+                if self.isExportOnlyWorldFile:
+                    result = False
+                    details += "A VRT has no world file"
+            elif extension not in [".jpg", ".bmp", ".png", ".tif", ".tiff"]:
                 result = False
                 if len(details) > 0:
                     details += "\n"
-                details += "The file must be an image"
+                details += "The file must be an image or a VRT"
 
-        if not result:
+        if result:
+            # read by the export
+            utils.setSettingValue(
+                utils.SETTING_EXPORT_COMPRESSION, self.comboBoxCompression.currentText()
+            )
+            utils.setSettingValue(utils.SETTING_EXPORT_LEVEL, self.spinBoxLevel.value())
+        else:
             message = "There were errors in the form"
 
         return result, message, details
@@ -9,19 +9,40 @@
  ***************************************************************************/
 """
 
+import functools
+import math
 import os.path
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QIcon
-from PyQt5.QtWidgets import QAction, QDialog, QDoubleSpinBox
-from qgis.core import QgsApplication, QgsMapLayer, QgsProject
+from PyQt5.QtWidgets import (
+    QAction,
+    QDialog,
+    QDoubleSpinBox,
+    QFileDialog,
+    QInputDialog,
+    QLineEdit,
+)
+from qgis.core import (
+    Qgis,
+    QgsApplication,
+    QgsMapLayer,
+    QgsMessageLog,
+    QgsProject,
+    QgsRenderContext,
+    QgsTask,
+)
 
 from . import resources_rc  # noqa
+from . import gdal_utils, rasterloader, utils
+from .batchexport import DEFAULT_TEMPLATE, BatchExport, templateError
+from .decodedcache import decodedCacheFromSettings
 from .exportgeorefrasterdialog import ExportGeorefRasterDialog
 from .freehandrastergeoreferencer_commands import ExportGeorefRasterCommand
 from .freehandrastergeoreferencer_layer import (
     FreehandRasterGeoreferencerLayer,
     FreehandRasterGeoreferencerLayerType,
+    LayerState,
 )
 from .freehandrastergeoreferencer_maptools import (
     AdjustRasterMapTool,
@@ -31,19 +52,49 @@ from .freehandrastergeoreferencer_maptools import (
     ScaleRasterMapTool,
 )
 from .freehandrastergeoreferencerdialog import FreehandRasterGeoreferencerDialog
+from .memorybudget import MemoryBudget
 
 
 class FreehandRasterGeoreferencer(object):
 
     PLUGIN_MENU = "&Freehand Raster Georeferencer"
+    # in ms, after the last change of the map canvas extent
+    NAVIGATION_SETTLE_DELAY = 400
+    # in ms, after the last render of a plugin layer: the pyramid levels and
+    # the tiles are read during the renders
+    MEMORY_BUDGET_DELAY = 2000
 
     def __init__(self, iface):
         self.iface = iface
         self.plugin_dir = os.path.dirname(__file__)
         self.layers = {}
+        # layer id => task building the overviews of its raster
+        self.overviewTasks = {}
+        # running in the background
+        self.exportCommands = []
+        self.batchExport = None
+        self.memoryBudget = MemoryBudget(self.layers)
+        QgsProject.instance().layersAdded.connect(self.layersAdded)
         QgsProject.instance().layerRemoved.connect(self.layerRemoved)
+        QgsProject.instance().readProject.connect(self.projectRead)
         self.iface.currentLayerChanged.connect(self.currentLayerChanged)
 
+        # active while the map canvas is navigated
+        self.settleTimer = QTimer()
+        self.settleTimer.setSingleShot(True)
+        self.settleTimer.setInterval(
+            FreehandRasterGeoreferencer.NAVIGATION_SETTLE_DELAY
+        )
+        self.settleTimer.timeout.connect(self.navigationSettled)
+        self.iface.mapCanvas().extentsChanged.connect(self.settleTimer.start)
+
+        self.memoryBudgetTimer = QTimer()
+        self.memoryBudgetTimer.setSingleShot(True)
+        self.memoryBudgetTimer.setInterval(
+            FreehandRasterGeoreferencer.MEMORY_BUDGET_DELAY
+        )
+        self.memoryBudgetTimer.timeout.connect(self.memoryBudget.enforce)
+
     def initGui(self):
         # Create actions
         self.actionAddLayer = QAction(
@@ -140,17 +191,50 @@ class FreehandRasterGeoreferencer(object):
 
         self.actionUndo = QAction(
             QIcon(":/plugins/freehandrastergeoreferencer/iconUndo.png"),
-            u"Undo",
+            "Undo",
             self.iface.mainWindow(),
         )
         self.actionUndo.triggered.connect(self.undo)
 
+        self.actionBuildOverviews = QAction(
+            "Build overviews of raster", self.iface.mainWindow()
+        )
+        self.actionBuildOverviews.setObjectName(
+            "FreehandRasterGeoreferencingLayerPlugin_BuildOverviews"
+        )
+        self.actionBuildOverviews.triggered.connect(self.buildOverviews)
+
+        self.actionClearDecodedCache = QAction(
+            "Clear cache of decoded rasters", self.iface.mainWindow()
+        )
+        self.actionClearDecodedCache.setObjectName(
+            "FreehandRasterGeoreferencingLayerPlugin_ClearDecodedCache"
+        )
+        self.actionClearDecodedCache.triggered.connect(self.clearDecodedCache)
+
+        self.actionBatchExport = QAction(
+            "Export all the rasters to a directory", self.iface.mainWindow()
+        )
+        self.actionBatchExport.setObjectName(
+            "FreehandRasterGeoreferencingLayerPlugin_BatchExport"
+        )
+        self.actionBatchExport.triggered.connect(self.exportAllRasters)
+
         # Add toolbar button and menu item for AddLayer
         self.iface.layerToolBar().addAction(self.actionAddLayer)
         self.iface.insertAddLayerAction(self.actionAddLayer)
         self.iface.addPluginToRasterMenu(
             FreehandRasterGeoreferencer.PLUGIN_MENU, self.actionAddLayer
         )
+        self.iface.addPluginToRasterMenu(
+            FreehandRasterGeoreferencer.PLUGIN_MENU, self.actionBuildOverviews
+        )
+        self.iface.addPluginToRasterMenu(
+            FreehandRasterGeoreferencer.PLUGIN_MENU, self.actionClearDecodedCache
+        )
+        self.iface.addPluginToRasterMenu(
+            FreehandRasterGeoreferencer.PLUGIN_MENU, self.actionBatchExport
+        )
 
         self.spinBoxRotate = QDoubleSpinBox(self.iface.mainWindow())
         self.spinBoxRotate.setDecimals(3)
@@ -208,21 +292,128 @@ class FreehandRasterGeoreferencer(object):
         self.iface.removePluginRasterMenu(
             FreehandRasterGeoreferencer.PLUGIN_MENU, self.actionAddLayer
         )
+        self.iface.removePluginRasterMenu(
+            FreehandRasterGeoreferencer.PLUGIN_MENU, self.actionBuildOverviews
+        )
+        self.iface.removePluginRasterMenu(
+            FreehandRasterGeoreferencer.PLUGIN_MENU, self.actionClearDecodedCache
+        )
+        self.iface.removePluginRasterMenu(
+            FreehandRasterGeoreferencer.PLUGIN_MENU, self.actionBatchExport
+        )
 
         # Unregister plugin layer type
         QgsApplication.pluginLayerRegistry().removePluginLayerType(
             FreehandRasterGeoreferencerLayer.LAYER_TYPE
         )
 
+        QgsProject.instance().layersAdded.disconnect(self.layersAdded)
         QgsProject.instance().layerRemoved.disconnect(self.layerRemoved)
+        QgsProject.instance().readProject.disconnect(self.projectRead)
         self.iface.currentLayerChanged.disconnect(self.currentLayerChanged)
+        self.iface.mapCanvas().extentsChanged.disconnect(self.settleTimer.start)
+        self.settleTimer.stop()
+        self.memoryBudgetTimer.stop()
 
         del self.toolbar
 
+    def isSmoothRender(self, renderContext):
+        """
+        Render quality policy: fast for preview renders and for the renders
+        of the map canvas while it is navigated (unless disabled in the
+        settings). Always smooth for the other renders (layouts, exports)
+        """
+        if not utils.settingValue(
+            utils.SETTING_ADAPTIVE_QUALITY, utils.DEFAULT_ADAPTIVE_QUALITY
+        ):
+            return True
+        if renderContext.flags() & QgsRenderContext.RenderPreviewJob:
+            return False
+        if not self.isCanvasRender(renderContext):
+            return True
+        return not self.settleTimer.isActive()
+
+    def isCanvasRender(self, renderContext):
+        """
+        If the render is for the current view of the map canvas: same
+        resolution, rotation and center
+        """
+        settings = self.iface.mapCanvas().mapSettings()
+        mapToPixel = renderContext.mapToPixel()
+        if not math.isclose(
+            mapToPixel.mapUnitsPerPixel(), settings.mapUnitsPerPixel(), rel_tol=1e-9
+        ):
+            return False
+        if not math.isclose(mapToPixel.mapRotation(), settings.rotation()):
+            return False
+        center = mapToPixel.transform(settings.visibleExtent().center())
+        size = settings.outputSize()
+        return (
+            abs(center.x() - size.width() / 2.0) < 1
+            and abs(center.y() - size.height() / 2.0) < 1
+        )
+
+    def scheduleMemoryBudget(self):
+        # enforced once the renders are done, not only after the loadings
+        self.memoryBudgetTimer.start()
+
+    def navigationSettled(self):
+        # draw again the layers drawn fast
+        for layer in self.layers.values():
+            if layer.isDrawnFast:
+                layer.repaint()
+
+    def layersAdded(self, layers):
+        # also the layers read from a project
+        for layer in layers:
+            if self.isPluginLayer(layer):
+                self.layers[layer.id()] = layer
+
+    def isPluginLayer(self, layer):
+        return (
+            layer.type() == QgsMapLayer.PluginLayer
+            and layer.pluginLayerType() == FreehandRasterGeoreferencerLayer.LAYER_TYPE
+        )
+
     def layerRemoved(self, layerId):
         if layerId in self.layers:
             del self.layers[layerId]
             self.checkCurrentLayerIsPluginLayer()
+            if self.batchExport is not None and self.batchExport.isRunning():
+                self.batchExport.layerRemoved(layerId)
+
+    def projectRead(self, doc):
+        """
+        Starts the loading of all the visible plugin layers of the project at
+        once, instead of one by one when they are first drawn. Layers on the
+        map canvas extent are loaded first
+        """
+        root = QgsProject.instance().layerTreeRoot()
+        layers = []
+        for layer in self.layers.values():
+            node = root.findLayer(layer.id())
+            if node is not None and not node.isVisible():
+                # hidden: loaded only if shown
+                continue
+            layers.append(layer)
+        for layer in layers:
+            # only reads the size of the images
+            layer.initializeLayer(deferLoading=True)
+
+        canvasExtent = self.iface.mapCanvas().extent()
+        canvasCenter = canvasExtent.center()
+
+        def loadOrder(layer):
+            extent = layer.extent()
+            return (
+                not extent.intersects(canvasExtent),
+                extent.center().sqrDist(canvasCenter),
+            )
+
+        layers.sort(key=loadOrder)
+        for i, layer in enumerate(layers):
+            # higher priority first in the task manager queue
+            layer.startLoadTask(len(layers) - i)
 
     def currentLayerChanged(self, layer):
         self.checkCurrentLayerIsPluginLayer()
@@ -242,6 +433,7 @@ class FreehandRasterGeoreferencer(object):
             self.actionDecreaseTransparency.setEnabled(True)
             self.actionIncreaseTransparency.setEnabled(True)
             self.actionExport.setEnabled(True)
+            self.actionBuildOverviews.setEnabled(True)
             self.spinBoxRotate.setEnabled(True)
             self.spinBoxRotateValueSetValue(layer.rotation)
             try:
@@ -267,6 +459,7 @@ class FreehandRasterGeoreferencer(object):
             self.actionDecreaseTransparency.setEnabled(False)
             self.actionIncreaseTransparency.setEnabled(False)
             self.actionExport.setEnabled(False)
+            self.actionBuildOverviews.setEnabled(False)
             self.spinBoxRotate.setEnabled(False)
             self.spinBoxRotateValueSetValue(0)
             try:
@@ -362,17 +555,147 @@ class FreehandRasterGeoreferencer(object):
 
     def exportGeorefRaster(self):
         layer = self.iface.activeLayer()
+        if layer.state != LayerState.LOADED:
+            # pixels freed for the memory budget
+            layer.reloadPixels()
+            layer.showBarMessage(
+                "Raster not loaded",
+                "The raster is still loading, export it when it is displayed.",
+                Qgis.Info,
+                5,
+            )
+            return
+
         self.dialogExportGeorefRaster.clear(layer)
         self.dialogExportGeorefRaster.show()
         result = self.dialogExportGeorefRaster.exec_()
         if result == 1:
             exportCommand = ExportGeorefRasterCommand(self.iface)
+            self.exportCommands = [
+                command for command in self.exportCommands if command.isRunning()
+            ]
             exportCommand.exportGeorefRaster(
                 layer,
                 self.dialogExportGeorefRaster.imagePath,
                 self.dialogExportGeorefRaster.isPutRotationInWorldFile,
                 self.dialogExportGeorefRaster.isExportOnlyWorldFile,
             )
+            if exportCommand.isRunning():
+                self.exportCommands.append(exportCommand)
+
+    def exportAllRasters(self):
+        if self.batchExport is not None and self.batchExport.isRunning():
+            self.iface.messageBar().pushMessage(
+                "Batch export", "An export is already running.", Qgis.Info, 5
+            )
+            return
+        if not self.layers:
+            self.iface.messageBar().pushMessage(
+                "Batch export", "No raster to export.", Qgis.Info, 5
+            )
+            return
+
+        directory = QFileDialog.getExistingDirectory(
+            self.iface.mainWindow(), "Export all the rasters to"
+        )
+        if not directory:
+            return
+        template, ok = QInputDialog.getText(
+            self.iface.mainWindow(),
+            "Batch export",
+            "File name ({name}: layer, {file}: raster file, {index}: number, "
+            "the extension gives the format):",
+            QLineEdit.Normal,
+            utils.settingValue(utils.SETTING_EXPORT_TEMPLATE, DEFAULT_TEMPLATE),
+        )
+        if not ok or not template:
+            return
+        # checked once rather than failing for every layer
+        error = templateError(template)
+        formats = list(gdal_utils.EXPORT_DRIVERS) + ["vrt"]
+        if error is None and utils.imageFormat(template) not in formats:
+            error = "The file name must end with .tif, .png, .jpg, .bmp or .vrt."
+        if error is not None:
+            self.iface.messageBar().pushMessage("Batch export", error, Qgis.Warning, 5)
+            return
+        utils.setSettingValue(utils.SETTING_EXPORT_TEMPLATE, template)
+
+        layers = sorted(self.layers.values(), key=lambda layer: layer.name())
+        self.batchExport = BatchExport(self.iface, layers, directory, template)
+        self.batchExport.start()
+
+    def buildOverviews(self):
+        layer = self.iface.activeLayer()
+        filepath = layer.getAbsoluteFilepath()
+        if utils.imageFormat(filepath) != "tif":
+            layer.showBarMessage(
+                "Overviews not built",
+                "Overviews can only be built for TIFF rasters.",
+                Qgis.Info,
+                5,
+            )
+            return
+        if layer.id() in self.overviewTasks:
+            return
+        if gdal_utils.overview_count(filepath) > 0:
+            layer.showBarMessage(
+                "Overviews not built",
+                "The raster already has overviews.",
+                Qgis.Info,
+                5,
+            )
+            return
+
+        task = QgsTask.fromFunction(
+            "Building overviews of %s" % layer.name(),
+            rasterloader.buildOverviews,
+            filepath,
+            on_finished=functools.partial(self.overviewsBuilt, layer.id()),
+        )
+        self.overviewTasks[layer.id()] = task
+        QgsApplication.taskManager().addTask(task)
+
+    def overviewsBuilt(self, layerId, exception, built=None):
+        del self.overviewTasks[layerId]
+        layer = self.layers.get(layerId)
+        if layer is None:
+            # removed meanwhile
+            return
+
+        if exception is not None:
+            QgsMessageLog.logMessage(repr(exception))
+            layer.showBarMessage(
+                "Overviews not built",
+                "There was an error building the overviews. "
+                "See QGIS Message log for details.",
+                Qgis.Critical,
+                5,
+            )
+        elif built:
+            # lower resolutions now read from the overviews
+            layer.loadImage(layer.getAbsoluteFilepath())
+            layer.repaint()
+        else:
+            layer.showBarMessage(
+                "Overviews not built", "The build was cancelled.", Qgis.Info, 3
+            )
+
+    def clearDecodedCache(self):
+        cache = decodedCacheFromSettings()
+        if cache is None:
+            self.iface.messageBar().pushMessage(
+                "Cache not enabled",
+                "Set the %s/%s setting to a directory to enable it."
+                % (utils.SETTINGS_KEY, utils.SETTING_DECODED_CACHE_DIR),
+                Qgis.Info,
+                5,
+            )
+            return
+
+        cache.clear()
+        self.iface.messageBar().pushMessage(
+            "Cache cleared", cache.directory, Qgis.Info, 3
+        )
 
     def spinBoxRotateUpdate(self, newParameters):
         self.spinBoxRotateValueSetValue(self.layer.rotation)
@@ -9,49 +9,177 @@
  ***************************************************************************/
 """
 
+import functools
 import math
 import os
 
-from PyQt5.QtCore import qDebug, QPointF, QRectF, QSize
-from PyQt5.QtGui import QColor, QImage, QImageWriter, QPainter
-from qgis.core import Qgis, QgsMessageLog
+import numpy as np
+from PyQt5.QtCore import qDebug, QPointF, QSize
+from PyQt5.QtGui import QColor, QImage, QPainter
+from qgis.core import Qgis, QgsApplication, QgsMessageLog, QgsTask
 from qgis.gui import QgsMessageBar
 
-from . import utils
+from . import gdal_utils, rasterloader, utils
+from .affinetransform import AffineTransform
+
+
+class ExportParameters:
+    """
+    Parameters of the export read from the layer in the main thread, since
+    the export itself runs in a background task
+    """
+
+    def __init__(self, layer, rasterPath, isPutRotationInWorldFile, crs):
+        self.filepath = layer.getAbsoluteFilepath()
+        self.rasterPath = rasterPath
+        self.rasterFormat = utils.imageFormat(rasterPath)
+        # None for VRT
+        self.driverName = gdal_utils.EXPORT_DRIVERS.get(self.rasterFormat)
+        self.geoTransform = layer.pixelToMapTransform().geoTransform()
+        self.wkt = crs.toWkt()
+        self.bands = layer.bands
+        if isPutRotationInWorldFile:
+            self.pixelSize = None
+        else:
+            # north up, maintain at least the original resolution
+            self.pixelSize = min(layer.xScale, layer.yScale)
+        # transparent background
+        self.alpha = self.rasterFormat in ("tif", "png")
+        # GeoTIFF only
+        self.compression = utils.settingValue(
+            utils.SETTING_EXPORT_COMPRESSION, utils.DEFAULT_EXPORT_COMPRESSION
+        )
+        # 1 (fastest) to 9 (smallest)
+        self.level = utils.settingValue(
+            utils.SETTING_EXPORT_LEVEL, utils.DEFAULT_EXPORT_LEVEL
+        )
+        self.overviews = utils.settingValue(
+            utils.SETTING_EXPORT_OVERVIEWS, utils.DEFAULT_EXPORT_OVERVIEWS
+        )
+        # stretch of the non-Byte bands, as displayed
+        self.percentClip = utils.settingValue(
+            utils.SETTING_PERCENT_CLIP, utils.DEFAULT_PERCENT_CLIP
+        )
+
+
+def isStreamable(layer):
+    """
+    If the raster can be exported from the file by GDAL: read by GDAL with
+    the pixels displayed by the layer (not a PDF rendered by QGIS)
+    """
+    filepath = layer.getAbsoluteFilepath()
+    if utils.imageFormat(filepath) == "pdf":
+        return False
+    return gdal_utils.raster_size(filepath) == (layer.imageWidth, layer.imageHeight)
+
+
+def taskProgress(task):
+    def progress(complete):
+        task.setProgress(100 * complete)
+        return not task.isCanceled()
+
+    return progress
+
+
+def exportRaster(task, parameters):
+    """
+    Writes the georeferenced raster from its file in a background task.
+    Returns the world file coefficients of the output, None if cancelled
+    """
+    if parameters.rasterFormat == "tif":
+        # all the bands
+        bandIndexes = None
+    else:
+        # formats limited to gray or RGB
+        nbands, _, _, _ = gdal_utils.format(parameters.filepath)
+        bandIndexes = rasterloader.displayedBands(parameters.bands, nbands)
+
+    geoTransform = gdal_utils.export_raster(
+        parameters.filepath,
+        parameters.rasterPath,
+        parameters.driverName,
+        parameters.geoTransform,
+        parameters.wkt,
+        parameters.pixelSize,
+        bandIndexes,
+        parameters.alpha,
+        taskProgress(task),
+        parameters.compression,
+        parameters.level,
+        parameters.overviews,
+        parameters.percentClip,
+    )
+    if geoTransform is None:
+        return None
+    return AffineTransform.fromGeoTransform(geoTransform).worldFile()
+
+
+def encodeImage(task, parameters, pixels, transform):
+    """
+    Writes the pixels of an image composed from the layer (see imagePixels)
+    in a background task. Returns the world file coefficients, None if
+    cancelled
+    """
+    if not gdal_utils.export_pixels(
+        pixels,
+        parameters.rasterPath,
+        parameters.driverName,
+        transform.geoTransform(),
+        parameters.wkt,
+        taskProgress(task),
+        parameters.compression,
+        parameters.level,
+        parameters.overviews,
+    ):
+        return None
+    return transform.worldFile()
+
+
+def imagePixels(image, nbands):
+    """
+    Copy of the pixels of the image as an array of shape (rows, cols, nbands):
+    RGBA if nbands is 4, RGB if 3
+    """
+    image = image.convertToFormat(QImage.Format_RGBA8888)
+    bits = image.constBits()
+    bits.setsize(image.byteCount())
+    rows = image.height()
+    cols = image.width()
+    pixels = np.frombuffer(bits, dtype=np.uint8).reshape(rows, image.bytesPerLine())
+    pixels = pixels[:, : cols * 4].reshape(rows, cols, 4)
+    return np.array(pixels[..., :nbands])
 
 
 class ExportGeorefRasterCommand(object):
     def __init__(self, iface):
         self.iface = iface
+        # export running in the background
+        self.task = None
+
+    def isRunning(self):
+        return self.task is not None
 
     def exportGeorefRaster(
         self, layer, rasterPath, isPutRotationInWorldFile, isExportOnlyWorldFile
     ):
-        baseRasterFilePath, _ = os.path.splitext(rasterPath)
-        # suppose supported format already checked
-        rasterFormat = utils.imageFormat(rasterPath)
+        if utils.imageFormat(rasterPath) == "vrt":
+            self.exportVrt(layer, rasterPath)
+            return
+        if not isExportOnlyWorldFile and isStreamable(layer):
+            # from the file, with bounded memory
+            self.startExportTask(layer, rasterPath, isPutRotationInWorldFile)
+            return
 
         try:
-            originalWidth = layer.image.width()
-            originalHeight = layer.image.height()
+            originalWidth = layer.imageWidth
+            originalHeight = layer.imageHeight
             radRotation = layer.rotation * math.pi / 180
 
             if isPutRotationInWorldFile or isExportOnlyWorldFile:
                 # keep the image as is and put all transformation params
                 # in world file
                 img = layer.image
-
-                a = layer.xScale * math.cos(radRotation)
-                # sin instead of -sin because angle in CW
-                b = -layer.yScale * math.sin(radRotation)
-                d = layer.xScale * -math.sin(radRotation)
-                e = -layer.yScale * math.cos(radRotation)
-                c = layer.center.x() - (
-                    a * (originalWidth - 1) / 2 + b * (originalHeight - 1) / 2
-                )
-                f = layer.center.y() - (
-                    d * (originalWidth - 1) / 2 + e * (originalHeight - 1) / 2
-                )
+                transform = layer.pixelToMapTransform()
 
             else:
                 # transform the image with rotation and scaling between the
@@ -86,76 +214,152 @@ class ExportGeorefRasterCommand(object):
                 painter.setRenderHint(QPainter.Antialiasing, True)
                 # painter.setRenderHint(QPainter.SmoothPixmapTransform, True)
 
-                rect = QRectF(
-                    QPointF(-layer.image.width() / 2.0, -layer.image.height() / 2.0),
-                    QPointF(layer.image.width() / 2.0, layer.image.height() / 2.0),
-                )
-
                 painter.translate(QPointF(width / 2.0, height / 2.0))
                 painter.rotate(layer.rotation)
                 painter.scale(scaleX, scaleY)
-                painter.drawImage(rect, layer.image)
+                painter.translate(QPointF(-originalWidth / 2.0, -originalHeight / 2.0))
+                layer.source.draw(painter, None, max(scaleX, scaleY))
                 painter.end()
 
                 extent = layer.extent()
-                a = extent.width() / width
-                e = -extent.height() / height
-                # 2nd term because (0,0) of world file is on center of upper
-                # left pixel instead of upper left corner of that pixel
-                c = extent.xMinimum() + a / 2
-                f = extent.yMaximum() + e / 2
-                b = d = 0.0
-
-            if not isExportOnlyWorldFile:
-                # export image
-                if rasterFormat == "tif":
-                    writer = QImageWriter()
-                    # use LZW compression for tiff
-                    # useful for scanned documents (mostly white)
-                    writer.setCompression(1)
-                    writer.setFormat(b"TIFF")
-                    writer.setFileName(rasterPath)
-                    writer.write(img)
-                else:
-                    img.save(rasterPath, rasterFormat)
-
-            worldFilePath = baseRasterFilePath + "."
-            if rasterFormat == "jpg":
-                worldFilePath += "jgw"
-            elif rasterFormat == "png":
-                worldFilePath += "pgw"
-            elif rasterFormat == "bmp":
-                worldFilePath += "bpw"
-            elif rasterFormat == "tif":
-                worldFilePath += "tfw"
-
-            with open(worldFilePath, "w") as writer:
-                # order is as described at
-                # http://webhelp.esri.com/arcims/9.3/General/topics/author_world_files.htm
-                writer.write(
-                    "%.13f\n%.13f\n%.13f\n%.13f\n%.13f\n%.13f" % (a, d, b, e, c, f)
+                transform = AffineTransform.translation(
+                    extent.xMinimum(), extent.yMaximum()
+                ) @ AffineTransform.scaling(
+                    extent.width() / width, -extent.height() / height
                 )
 
-            crsFilePath = rasterPath + ".aux.xml"
-            with open(crsFilePath, "w") as writer:
-                writer.write(
-                    self.auxContent(
-                        self.iface.mapCanvas().mapSettings().destinationCrs()
-                    )
-                )
+            if isExportOnlyWorldFile:
+                self.writeWorldFile(rasterPath, transform.worldFile())
+                self.showExported()
+                return
 
-            widget = QgsMessageBar.createMessage(
-                "Raster Geoferencer", "Raster exported successfully."
+            if img is None:
+                # layer read by tiles: assemble the full image
+                img = self.sourceImage(layer)
+            parameters = self.exportParameters(
+                layer, rasterPath, isPutRotationInWorldFile
+            )
+            # alpha for a transparent background if supported
+            nbands = 4 if parameters.alpha else 3
+            # encoded in the background
+            self.startTask(
+                "Exporting %s" % layer.name(),
+                rasterPath,
+                encodeImage,
+                parameters,
+                imagePixels(img, nbands),
+                transform,
             )
-            self.iface.messageBar().pushWidget(widget, Qgis.Info, 2)
         except Exception as ex:
-            QgsMessageLog.logMessage(repr(ex))
+            self.showError(ex)
+
+    def exportVrt(self, layer, rasterPath):
+        # references the raster file: no pixel copied
+        if not isStreamable(layer):
             widget = QgsMessageBar.createMessage(
                 "Raster Geoferencer",
-                "There was an error performing this command. "
-                "See QGIS Message log for details.",
+                "Only rasters read by GDAL can be exported to VRT.",
+            )
+            self.iface.messageBar().pushWidget(widget, Qgis.Warning, 5)
+            return
+        try:
+            gdal_utils.georeferenced_vrt(
+                layer.getAbsoluteFilepath(),
+                layer.pixelToMapTransform().geoTransform(),
+                self.iface.mapCanvas().mapSettings().destinationCrs().toWkt(),
+                path=rasterPath,
+            )
+            self.showExported()
+        except Exception as ex:
+            self.showError(ex)
+
+    def exportParameters(self, layer, rasterPath, isPutRotationInWorldFile):
+        return ExportParameters(
+            layer,
+            rasterPath,
+            isPutRotationInWorldFile,
+            self.iface.mapCanvas().mapSettings().destinationCrs(),
+        )
+
+    def startExportTask(self, layer, rasterPath, isPutRotationInWorldFile):
+        parameters = self.exportParameters(layer, rasterPath, isPutRotationInWorldFile)
+        self.startTask(
+            "Exporting %s" % layer.name(), rasterPath, exportRaster, parameters
+        )
+
+    def startTask(self, description, rasterPath, function, *args):
+        self.task = QgsTask.fromFunction(
+            description,
+            function,
+            *args,
+            on_finished=functools.partial(self.exportFinished, rasterPath),
+        )
+        QgsApplication.taskManager().addTask(self.task)
+
+    def exportFinished(self, rasterPath, exception, worldFile=None):
+        self.task = None
+        if exception is not None:
+            self.showError(exception)
+            return
+        if worldFile is None:
+            widget = QgsMessageBar.createMessage(
+                "Raster Geoferencer", "Raster export cancelled."
             )
-            self.iface.messageBar().pushWidget(widget, Qgis.Critical, 5)
+            self.iface.messageBar().pushWidget(widget, Qgis.Info, 2)
+            return
+        try:
+            if utils.imageFormat(rasterPath) != "tif":
+                # GeoTIFF: georeferencing embedded
+                self.writeWorldFile(rasterPath, worldFile)
+            self.showExported()
+        except Exception as ex:
+            self.showError(ex)
+
+    def writeWorldFile(self, rasterPath, worldFile):
+        baseRasterFilePath, _ = os.path.splitext(rasterPath)
+        rasterFormat = utils.imageFormat(rasterPath)
+        worldFilePath = baseRasterFilePath + "."
+        if rasterFormat == "jpg":
+            worldFilePath += "jgw"
+        elif rasterFormat == "png":
+            worldFilePath += "pgw"
+        elif rasterFormat == "bmp":
+            worldFilePath += "bpw"
+        elif rasterFormat == "tif":
+            worldFilePath += "tfw"
+
+        with open(worldFilePath, "w") as writer:
+            # order is as described at
+            # http://webhelp.esri.com/arcims/9.3/General/topics/author_world_files.htm
+            writer.write("%.13f\n%.13f\n%.13f\n%.13f\n%.13f\n%.13f" % worldFile)
+
+        crsFilePath = rasterPath + ".aux.xml"
+        with open(crsFilePath, "w") as writer:
+            writer.write(
+                self.auxContent(self.iface.mapCanvas().mapSettings().destinationCrs())
+            )
+
+    def showExported(self):
+        widget = QgsMessageBar.createMessage(
+            "Raster Geoferencer", "Raster exported successfully."
+        )
+        self.iface.messageBar().pushWidget(widget, Qgis.Info, 2)
+
+    def showError(self, exception):
+        QgsMessageLog.logMessage(repr(exception))
+        widget = QgsMessageBar.createMessage(
+            "Raster Geoferencer",
+            "There was an error performing this command. "
+            "See QGIS Message log for details.",
+        )
+        self.iface.messageBar().pushWidget(widget, Qgis.Critical, 5)
+
+    def sourceImage(self, layer):
+        img = QImage(QSize(layer.imageWidth, layer.imageHeight), QImage.Format_RGB32)
+        painter = QPainter(img)
+        layer.source.draw(painter, None, 1.0)
+        painter.end()
+        return img
 
     def auxContent(self, crs):
         content = """<PAMDataset>
@@ -9,38 +9,47 @@
  ***************************************************************************/
 """
 
+import functools
 import math
 import os
+import time
 
 import numpy as np
 from osgeo import gdal
 from PyQt5.QtCore import (
     pyqtSignal,
     qDebug,
-    QFileInfo,
     QPointF,
     QRectF,
-    QSettings,
-    QSize,
     Qt,
 )
-from PyQt5.QtGui import QColor, QImage, QImageReader, QPainter, QPen
+from PyQt5.QtGui import (
+    QColor,
+    QPainter,
+    QPen,
+    QTransform,
+)
+from PyQt5.QtWidgets import QDialog
 from qgis.core import (
     Qgis,
+    QgsApplication,
     QgsCoordinateReferenceSystem,
     QgsCoordinateTransform,
     QgsDataProvider,
+    QgsLineString,
     QgsMapLayerRenderer,
     QgsMessageLog,
     QgsPluginLayer,
     QgsPluginLayerType,
     QgsPointXY,
     QgsProject,
-    QgsRasterLayer,
     QgsRectangle,
+    QgsTask,
 )
 
-from . import gdal_utils, utils
+from . import rasterloader, utils
+from .affinetransform import AffineTransform
+from .imagepyramid import ImagePyramid
 from .loaderrordialog import LoadErrorDialog
 
 
@@ -49,10 +58,51 @@ class LayerDefaultSettings:
     BLEND_MODE = "SourceOver"
 
 
+class LayerState:
+    # image size, CRS and transform parameters not known yet
+    NOT_INITIALIZED = "notInitialized"
+    INITIALIZING = "initializing"
+    # pixels decoded in a background task: only the outline is drawn
+    LOADING = "loading"
+    LOADED = "loaded"
+    # pixels freed for the memory budget: a low resolution version is drawn
+    # until they are loaded again
+    UNLOADED = "unloaded"
+    ERROR = "error"
+
+
+def pointArray(points):
+    points = np.asarray(points, dtype=np.float64)
+    if points.ndim != 2 or points.shape[1] != 2:
+        raise ValueError("Expected an array of shape (n, 2), got %r" % (points.shape,))
+    return points
+
+
+def reprojectPoints(points, sourceCrs, destCrs):
+    """
+    Reprojects an array of shape (n, 2) with the transformations (datum
+    shifts) of the project, like the map canvas. The points are transformed
+    in one call as the vertices of a line
+    """
+    if len(points) == 0:
+        return points.copy()
+    transform = QgsCoordinateTransform(sourceCrs, destCrs, QgsProject.instance())
+    line = QgsLineString(points[:, 0].tolist(), points[:, 1].tolist())
+    line.transform(transform)
+    return np.column_stack(
+        (
+            np.array(line.xVector(), dtype=np.float64),
+            np.array(line.yVector(), dtype=np.float64),
+        )
+    )
+
+
 class FreehandRasterGeoreferencerLayer(QgsPluginLayer):
 
     LAYER_TYPE = "FreehandRasterGeoreferencerLayer"
     transformParametersChanged = pyqtSignal(tuple)
+    # from the render thread: the loading is started in the main thread
+    reloadRequested = pyqtSignal()
 
     def __init__(self, plugin, filepath, title, screenExtent):
         QgsPluginLayer.__init__(
@@ -80,9 +130,34 @@ class FreehandRasterGeoreferencerLayer(QgsPluginLayer):
         self.xScale = 1.0
         self.yScale = 1.0
 
-        self.error = False
-        self.initializing = False
-        self.initialized = False
+        # image fully loaded in memory (None if read by tiles)
+        self.image = None
+        self.imageBuffer = None
+        # size of the image in a memory-mapped file (can be paged out)
+        self.mappedBytes = 0
+        # what is drawn: pyramid of image or tiles read when needed
+        self.source = None
+        self.imageWidth = 0
+        self.imageHeight = 0
+        # None for default
+        self.bands = None
+
+        self.state = LayerState.NOT_INITIALIZED
+        # to ignore the results of outdated loadings
+        self.loadId = 0
+        self.loadTask = None
+        # created but not started yet (see startLoadTask)
+        self.pendingLoadTask = None
+        # extent to fit once the size of the image is known (decoded)
+        self.pendingScreenExtent = None
+        # for the memory budget
+        self.lastDrawn = 0.0
+        # to draw smooth once the map is not navigated anymore
+        self.isDrawnFast = False
+        # not drawn during the gestures of the map tools (shadow drawn
+        # instead) without changing the visibility in the layer tree
+        self.isHiddenForGesture = False
+        self.reloadRequested.connect(self.reloadPixels)
         self.initializeLayer(screenExtent)
         self._extent = None
 
@@ -176,16 +251,47 @@ class FreehandRasterGeoreferencerLayer(QgsPluginLayer):
     def repaint(self):
         self.repaintRequested.emit()
 
+    def setHiddenForGesture(self, hidden):
+        self.isHiddenForGesture = hidden
+        # only this layer is rendered again: the other layers are drawn from
+        # the cache of the map canvas
+        self.repaint()
+
     def transformParameters(self):
         return (self.center, self.rotation, self.xScale, self.yScale)
 
-    def initializeLayer(self, screenExtent=None):
-        if self.error or self.initialized or self.initializing:
+    def setImageSize(self, width, height):
+        # persisted so the extent is known without reading the image
+        self.imageWidth = width
+        self.imageHeight = height
+        self.setCustomProperty("imageWidth", width)
+        self.setCustomProperty("imageHeight", height)
+
+    def setSource(self, source):
+        self.source = source
+        self.setImageSize(source.width(), source.height())
+
+    def setBands(self, bands):
+        self.bands = bands
+        if bands:
+            self.setCustomProperty("bands", ",".join(str(band) for band in bands))
+        else:
+            self.removeCustomProperty("bands")
+        QgsProject.instance().setDirty(True)
+        if self.state in (LayerState.LOADING, LayerState.LOADED, LayerState.UNLOADED):
+            # reload with new bands
+            self.loadImage(self.getAbsoluteFilepath())
+            self.repaint()
+
+    def initializeLayer(self, screenExtent=None, deferLoading=False):
+        # deferLoading: the decoding of the pixels is started later by
+        # startLoadTask
+        if self.state != LayerState.NOT_INITIALIZED:
             return
 
         if self.filepath is not None:
             # not safe...
-            self.initializing = True
+            self.state = LayerState.INITIALIZING
             absPath = self.getAbsoluteFilepath()
 
             if not os.path.exists(absPath):
@@ -200,41 +306,16 @@ class FreehandRasterGeoreferencerLayer(QgsPluginLayer):
                     self.setCustomProperty("filepath", self.filepath)
                     QgsProject.instance().setDirty(True)
                 else:
-                    self.error = True
+                    self.state = LayerState.ERROR
 
                 del loadErrorDialog
 
-            imageFormat = utils.imageFormat(absPath)
-            if imageFormat == "pdf":
-                s = QSettings()
-                oldValidation = s.value("/Projections/defaultBehavior")
-                s.setValue(
-                    "/Projections/defaultBehavior", "useGlobal"
-                )  # for not asking about crs
-                layer = QgsRasterLayer(absPath, os.path.basename(absPath))
-                self.image = layer.previewAsImage(QSize(layer.width(), layer.height()))
-                s.setValue("/Projections/defaultBehavior", oldValidation)
-            else:
-                has_corrected = False
-                if imageFormat == "tif":
-                    # other than TIFF => assumes can be loaded by Qt
-                    has_corrected = self.preCheckImage(absPath)
-                if has_corrected:
-                    # image already loaded by preCheckImage
-                    self.showBarMessage(
-                        "Raster changed",
-                        "Raster content has been transformed for display in the "
-                        "plugin. "
-                        "When exporting, select the 'Only export world file' checkbox.",
-                        Qgis.Warning,
-                        10,
-                    )
-                else:
-                    reader = QImageReader(absPath)
-                    self.image = reader.read()
+                if self.state == LayerState.ERROR:
+                    return
 
-            self.initialized = True
-            self.initializing = False
+            self.loadImage(absPath, deferLoading)
+            if self.state == LayerState.ERROR:
+                return
 
             self.setupCrs()
 
@@ -256,69 +337,157 @@ class FreehandRasterGeoreferencerLayer(QgsPluginLayer):
                     self.setCenter(screenExtent.center())
                     self.setRotation(0.0)
 
-                    sw = screenExtent.width()
-                    sh = screenExtent.height()
+                    if self.imageWidth > 0 and self.imageHeight > 0:
+                        self.resetScale(screenExtent.width(), screenExtent.height())
+                        self.commitTransformParameters()
+                    else:
+                        # size known once decoded (see rasterLoaded)
+                        self.pendingScreenExtent = screenExtent
 
-                    self.resetScale(sw, sh)
+    def loadImage(self, absPath, deferLoading=False):
+        """
+        Starts the loading of the image: the pixels are decoded in a
+        background task (except PDF). The size of the image is known when it
+        returns if it can be read without decoding (0 otherwise)
+        """
+        self.loadId += 1
+        if self.loadTask is not None:
+            self.loadTask.cancel()
+            self.loadTask = None
+        self.pendingLoadTask = None
+
+        if utils.imageFormat(absPath) == "pdf":
+            self.rasterLoaded(rasterloader.loadPdf(absPath))
+            return
 
-                    self.commitTransformParameters()
+        options = rasterloader.LoadOptions(self.bands)
+        size = rasterloader.imageSize(absPath)
+        if size is None:
+            # known once decoded
+            size = (0, 0)
+        if size != (self.imageWidth, self.imageHeight) or size == (0, 0):
+            # previous pixels cannot be used as placeholder
+            self.image = self.imageBuffer = self.source = None
+            self.mappedBytes = 0
+            self.setImageSize(*size)
+            self._extent = None
+        self.state = LayerState.LOADING
+
+        self.pendingLoadTask = QgsTask.fromFunction(
+            "Loading raster %s" % os.path.basename(absPath),
+            rasterloader.loadRaster,
+            absPath,
+            options,
+            on_finished=functools.partial(self.loadTaskFinished, self.loadId),
+        )
+        if not deferLoading:
+            self.startLoadTask()
 
-    def preCheckImage(self, filepath):
-        nbands, datatype, width, height = gdal_utils.format(filepath)
-
-        pixels = None
-        if nbands not in (1, 3):
-            pixels = gdal_utils.pixels(filepath)
-            if nbands > 3:
-                # first 3
-                pixels = pixels[:3]
-                nbands = 3
-
-            if nbands == 2:
-                # remove band 2
-                pixels = pixels[0][np.newaxis, ...]
-                nbands = 1
-
-        if datatype != "Byte":
-            pixels = pixels if pixels is not None else gdal_utils.pixels(filepath)
-
-            bands = np.empty(np.shape(pixels), dtype=np.uint8)
-            for i in range(nbands):
-                band_pixels = pixels[i]
-                bands[i] = gdal_utils.to_byte(band_pixels)
-            pixels = bands
-
-        if pixels is not None:
-            # some transformation done# band at the end
-            pixels = np.transpose(pixels, [1, 2, 0])
-            pixels = pixels.ravel()
-
-            if nbands == 1:
-                # monochrome
-                format = QImage.Format_Grayscale8
-                bytesPerLine = width
-            else:
-                format = QImage.Format_RGB888
-                bytesPerLine = 3 * width
-
-            # Byte
-            qImg = QImage(pixels, width, height, bytesPerLine, format)
-            self.image = qImg
+    def startLoadTask(self, priority=0):
+        if self.pendingLoadTask is None:
+            return
+        self.loadTask = self.pendingLoadTask
+        self.pendingLoadTask = None
+        # the task manager runs the tasks on a pool bounded by the number of
+        # cores
+        QgsApplication.taskManager().addTask(self.loadTask, priority)
+
+    def loadTaskFinished(self, loadId, exception, loaded=None):
+        if loadId != self.loadId:
+            # replaced by a more recent loading
+            return
+        self.loadTask = None
 
-            return True
+        if exception is None and loaded is None:
+            # cancelled (not by a new loading): loaded again at the next draw
+            self.state = LayerState.UNLOADED
+        elif loaded is None:
+            self.loadingFailed(exception)
+        else:
+            self.rasterLoaded(loaded)
+        self.repaint()
 
-        return False
+    def rasterLoaded(self, loaded):
+        self.image = loaded.image
+        self.imageBuffer = loaded.imageBuffer
+        self.mappedBytes = loaded.mappedBytes()
+        self.setSource(loaded.source)
+        self._extent = None
+        self.state = LayerState.LOADED
+        self.plugin.memoryBudget.enforce(self)
+
+        if self.pendingScreenExtent is not None:
+            screenExtent = self.pendingScreenExtent
+            self.pendingScreenExtent = None
+            self.resetScale(screenExtent.width(), screenExtent.height())
+            self.commitTransformParameters()
+
+        if loaded.isTransformed:
+            self.showBarMessage(
+                "Raster changed",
+                "Raster content has been transformed for display in the "
+                "plugin. "
+                "When exporting, select the 'Only export world file' checkbox.",
+                Qgis.Warning,
+                10,
+            )
+
+    def memoryUsage(self):
+        # in bytes, of the pixels held in memory (levels or tiles), not
+        # counting the image if in a memory-mapped file
+        if self.source is None:
+            return 0
+        return self.source.byteCount() - self.mappedBytes
+
+    def unloadPixels(self):
+        """
+        Frees the decoded pixels. Returns the number of bytes freed
+        """
+        if self.state != LayerState.LOADED:
+            return 0
+        usage = self.memoryUsage()
+        if self.image is None:
+            # tiles: read again when needed
+            self.source.clearCache()
+            return usage - self.memoryUsage()
+
+        # smallest level kept as placeholder until loaded again at the next
+        # draw, if already computed (not computed to free memory): only the
+        # outline drawn otherwise
+        preview = self.source.computedSmallestLevel()
+        self.image = self.imageBuffer = None
+        self.mappedBytes = 0
+        if preview is None:
+            self.source = None
+        else:
+            self.source = ImagePyramid(preview, self.imageWidth, self.imageHeight)
+        self.state = LayerState.UNLOADED
+        return usage - self.memoryUsage()
+
+    def reloadPixels(self):
+        if self.state == LayerState.UNLOADED:
+            self.loadImage(self.getAbsoluteFilepath())
+
+    def loadingFailed(self, exception):
+        self.state = LayerState.ERROR
+        QgsMessageLog.logMessage(repr(exception))
+        self.showBarMessage(
+            "Raster not loaded",
+            "There was an error loading the raster. "
+            "See QGIS Message log for details.",
+            Qgis.Critical,
+            5,
+        )
 
     def initializeExistingGeoreferencing(self, dataset, georef):
         # georef can have scaling, rotation or translation
         rotation = 180 / math.pi * -math.atan2(georef[4], georef[1])
         sx = math.sqrt(georef[1] ** 2 + georef[4] ** 2)
         sy = math.sqrt(georef[2] ** 2 + georef[5] ** 2)
-        i_center_x = self.image.width() / 2
-        i_center_y = self.image.height() / 2
         center = QgsPointXY(
-            georef[0] + georef[1] * i_center_x + georef[2] * i_center_y,
-            georef[3] + georef[4] * i_center_x + georef[5] * i_center_y,
+            *AffineTransform.fromGeoTransform(georef).transformPoint(
+                self.imageWidth / 2, self.imageHeight / 2
+            )
         )
 
         qDebug(repr(rotation) + " " + repr((sx, sy)) + " " + repr(center))
@@ -380,8 +549,8 @@ class FreehandRasterGeoreferencerLayer(QgsPluginLayer):
         return georef[0] == 0 and georef[3] == 0 and georef[1] == 1 and georef[5] == 1
 
     def resetScale(self, sw, sh):
-        iw = self.image.width()
-        ih = self.image.height()
+        iw = self.imageWidth
+        ih = self.imageHeight
         wratio = sw / iw
         hratio = sh / ih
 
@@ -401,22 +570,7 @@ class FreehandRasterGeoreferencerLayer(QgsPluginLayer):
         self.setCustomProperty("filepath", self.filepath)
         self.setName(title)
 
-        fileInfo = QFileInfo(filepath)
-        ext = fileInfo.suffix()
-        if ext == "pdf":
-            s = QSettings()
-            oldValidation = s.value("/Projections/defaultBehavior")
-            s.setValue(
-                "/Projections/defaultBehavior", "useGlobal"
-            )  # for not asking about crs
-            path = fileInfo.filePath()
-            baseName = fileInfo.baseName()
-            layer = QgsRasterLayer(path, baseName)
-            self.image = layer.previewAsImage(QSize(layer.width(), layer.height()))
-            s.setValue("/Projections/defaultBehavior", oldValidation)
-        else:
-            reader = QImageReader(filepath)
-            self.image = reader.read()
+        self.loadImage(self.getAbsoluteFilepath())
         self.repaint()
 
     def clone(self):
@@ -442,132 +596,139 @@ class FreehandRasterGeoreferencerLayer(QgsPluginLayer):
         return filepath
 
     def extent(self):
-        self.initializeLayer()
-        if not self.initialized:
+        if self.imageWidth <= 0 or self.imageHeight <= 0:
+            # image size not restored from the project
+            self.initializeLayer()
+        if (
+            self.state in (LayerState.INITIALIZING, LayerState.ERROR)
+            or self.imageWidth <= 0
+            or self.imageHeight <= 0
+        ):
             qDebug("Not Initialized")
             return QgsRectangle(0, 0, 1, 1)
 
         if self._extent:
             return self._extent
 
-        topLeft, topRight, bottomRight, bottomLeft = self.cornerCoordinates()
+        corners = self.pixelToMapTransform().transformPoints(self.cornerPixels())
+        left, bottom = corners.min(axis=0).tolist()
+        right, top = corners.max(axis=0).tolist()
 
-        left = min(topLeft.x(), topRight.x(), bottomRight.x(), bottomLeft.x())
-        right = max(topLeft.x(), topRight.x(), bottomRight.x(), bottomLeft.x())
-        top = max(topLeft.y(), topRight.y(), bottomRight.y(), bottomLeft.y())
-        bottom = min(topLeft.y(), topRight.y(), bottomRight.y(), bottomLeft.y())
-
-        # recenter + create rectangle
         self._extent = QgsRectangle(left, bottom, right, top)
         return self._extent
 
-    def cornerCoordinates(self):
-        return self.transformedCornerCoordinates(
+    def pixelToMapTransform(self):
+        return self.transformFromParameters(
             self.center, self.rotation, self.xScale, self.yScale
         )
 
-    def transformedCornerCoordinates(self, center, rotation, xScale, yScale):
-        # scale
-        topLeft = QgsPointXY(
-            -self.image.width() / 2.0 * xScale, self.image.height() / 2.0 * yScale
-        )
-        topRight = QgsPointXY(
-            self.image.width() / 2.0 * xScale, self.image.height() / 2.0 * yScale
-        )
-        bottomLeft = QgsPointXY(
-            -self.image.width() / 2.0 * xScale, -self.image.height() / 2.0 * yScale
+    def transformFromParameters(self, center, rotation, xScale, yScale):
+        """
+        Transform from the pixel coordinates of the image (origin at the top
+        left corner, y down) to map coordinates
+        """
+        # minus sign because rotation is CW in this class and Qt
+        return (
+            AffineTransform.translation(center.x(), center.y())
+            @ AffineTransform.rotation(-rotation)
+            @ AffineTransform.scaling(xScale, -yScale)
+            @ AffineTransform.translation(
+                -self.imageWidth / 2.0, -self.imageHeight / 2.0
+            )
         )
-        bottomRight = QgsPointXY(
-            self.image.width() / 2.0 * xScale, -self.image.height() / 2.0 * yScale
+
+    def transformFromPoint(self, startPoint, rotation, xScale, yScale):
+        """
+        Transform after a rotation and a scaling around startPoint (fixed
+        point of the movement): the scales multiply self.xScale and
+        self.yScale (in the frame of the image) and the offset of the center
+        from startPoint, then the rotation is added to self.rotation and
+        applied to that offset, then the center is translated back from
+        startPoint
+        """
+        dX = (self.center.x() - startPoint.x()) * xScale
+        dY = (self.center.y() - startPoint.y()) * yScale
+        # minus sign because rotation is CW in this class and Qt
+        dX, dY = AffineTransform.rotation(-rotation).transformPoint(dX, dY)
+        center = QgsPointXY(startPoint.x() + dX, startPoint.y() + dY)
+        return self.transformFromParameters(
+            center, self.rotation + rotation, self.xScale * xScale, self.yScale * yScale
         )
 
-        # rotate
-        # minus sign because rotation is CW in this class and Qt)
-        rotationRad = -rotation * math.pi / 180
-        cosRot = math.cos(rotationRad)
-        sinRot = math.sin(rotationRad)
+    def pixelToMap(self, points, crs=None):
+        """
+        Map coordinates of an array of (column, row) pixel coordinates of the
+        image (origin at the top left corner of the image), of shape (n, 2).
+        In the CRS of the layer, or reprojected to crs with the transformations
+        of the project. Returns an array of shape (n, 2)
 
-        topLeft = self._rotate(topLeft, cosRot, sinRot)
-        topRight = self._rotate(topRight, cosRot, sinRot)
-        bottomRight = self._rotate(bottomRight, cosRot, sinRot)
-        bottomLeft = self._rotate(bottomLeft, cosRot, sinRot)
+        From the QGIS Python console:
+            layer.pixelToMap(np.array([[0, 0], [120.5, 340.0]]))
+        """
+        points = pointArray(points)
+        mapPoints = self.pixelToMapTransform().transformPoints(points)
+        if crs is not None and crs != self.crs():
+            mapPoints = reprojectPoints(mapPoints, self.crs(), crs)
+        return mapPoints
 
-        topLeft.set(topLeft.x() + center.x(), topLeft.y() + center.y())
-        topRight.set(topRight.x() + center.x(), topRight.y() + center.y())
-        bottomRight.set(bottomRight.x() + center.x(), bottomRight.y() + center.y())
-        bottomLeft.set(bottomLeft.x() + center.x(), bottomLeft.y() + center.y())
+    def mapToPixel(self, points, crs=None):
+        """
+        Inverse of pixelToMap: points in the CRS of the layer, or in crs
+        """
+        points = pointArray(points)
+        if crs is not None and crs != self.crs():
+            points = reprojectPoints(points, crs, self.crs())
+        return self.pixelToMapTransform().inverted().transformPoints(points)
+
+    def cornerPixels(self):
+        # topLeft, topRight, bottomRight, bottomLeft
+        w = self.imageWidth
+        h = self.imageHeight
+        return [(0, 0), (w, 0), (w, h), (0, h)]
+
+    def cornerCoordinates(self):
+        return self.transformedCornerCoordinates(
+            self.center, self.rotation, self.xScale, self.yScale
+        )
 
-        return (topLeft, topRight, bottomRight, bottomLeft)
+    def transformedCornerCoordinates(self, center, rotation, xScale, yScale):
+        transform = self.transformFromParameters(center, rotation, xScale, yScale)
+        return self._cornerPoints(transform)
 
     def transformedCornerCoordinatesFromPoint(
         self, startPoint, rotation, xScale, yScale
     ):
-        # startPoint is a fixed point for this new movement (rotation and
-        # scale)
-        # rotation is the global rotation of the image
-        # xScale is the new xScale factor to be multiplied by self.xScale
-        # idem for yScale
-        # Calculate the coordinate of the center in a startPoint origin
-        # coordinate system and apply scales
-        dX = (self.center.x() - startPoint.x()) * xScale
-        dY = (self.center.y() - startPoint.y()) * yScale
-        # Half width and half height in the current transformation
-        hW = (self.image.width() / 2.0) * self.xScale * xScale
-        hH = (self.image.height() / 2.0) * self.yScale * yScale
-        # Actual rectangle coordinates :
-        pt1 = QgsPointXY(-hW, hH)
-        pt2 = QgsPointXY(hW, hH)
-        pt3 = QgsPointXY(hW, -hH)
-        pt4 = QgsPointXY(-hW, -hH)
-        # Actual rotation from the center
-        # minus sign because rotation is CW in this class and Qt)
-        rotationRad = -self.rotation * math.pi / 180
-        cosRot = math.cos(rotationRad)
-        sinRot = math.sin(rotationRad)
-        pt1 = self._rotate(pt1, cosRot, sinRot)
-        pt2 = self._rotate(pt2, cosRot, sinRot)
-        pt3 = self._rotate(pt3, cosRot, sinRot)
-        pt4 = self._rotate(pt4, cosRot, sinRot)
-        # Second transformation
-        # displacement of the origin
-        pt1 = QgsPointXY(pt1.x() + dX, pt1.y() + dY)
-        pt2 = QgsPointXY(pt2.x() + dX, pt2.y() + dY)
-        pt3 = QgsPointXY(pt3.x() + dX, pt3.y() + dY)
-        pt4 = QgsPointXY(pt4.x() + dX, pt4.y() + dY)
-        # Rotation
-        # minus sign because rotation is CW in this class and Qt)
-        rotationRad = -rotation * math.pi / 180
-        cosRot = math.cos(rotationRad)
-        sinRot = math.sin(rotationRad)
-        pt1 = self._rotate(pt1, cosRot, sinRot)
-        pt2 = self._rotate(pt2, cosRot, sinRot)
-        pt3 = self._rotate(pt3, cosRot, sinRot)
-        pt4 = self._rotate(pt4, cosRot, sinRot)
-        # translate to startPoint
-        pt1 = QgsPointXY(pt1.x() + startPoint.x(), pt1.y() + startPoint.y())
-        pt2 = QgsPointXY(pt2.x() + startPoint.x(), pt2.y() + startPoint.y())
-        pt3 = QgsPointXY(pt3.x() + startPoint.x(), pt3.y() + startPoint.y())
-        pt4 = QgsPointXY(pt4.x() + startPoint.x(), pt4.y() + startPoint.y())
-
-        return (pt1, pt2, pt3, pt4)
+        transform = self.transformFromPoint(startPoint, rotation, xScale, yScale)
+        return self._cornerPoints(transform)
 
     def moveCenterFromPointRotate(self, startPoint, rotation, xScale, yScale):
-        cornerPoints = self.transformedCornerCoordinatesFromPoint(
-            startPoint, rotation, xScale, yScale
-        )
+        transform = self.transformFromPoint(startPoint, rotation, xScale, yScale)
         self.center = QgsPointXY(
-            (cornerPoints[0].x() + cornerPoints[2].x()) / 2,
-            (cornerPoints[0].y() + cornerPoints[2].y()) / 2,
+            *transform.transformPoint(self.imageWidth / 2.0, self.imageHeight / 2.0)
         )
 
-    def _rotate(self, point, cosRot, sinRot):
-        return QgsPointXY(
-            point.x() * cosRot - point.y() * sinRot,
-            point.x() * sinRot + point.y() * cosRot,
-        )
+    def _cornerPoints(self, transform):
+        corners = transform.transformPoints(self.cornerPixels())
+        return tuple(QgsPointXY(x, y) for x, y in corners.tolist())
 
     def createMapRenderer(self, rendererContext):
-        return FreehandRasterGeoreferencerLayerRenderer(self, rendererContext)
+        self.initializeLayer()
+        if self.isDrawable():
+            self.lastDrawn = time.monotonic()
+        if self.state == LayerState.UNLOADED:
+            self.reloadRequested.emit()
+        smooth = self.plugin.isSmoothRender(rendererContext)
+        self.isDrawnFast = not smooth
+        self.plugin.scheduleMemoryBudget()
+        return FreehandRasterGeoreferencerLayerRenderer(self, rendererContext, smooth)
+
+    def isDrawable(self):
+        # at least the outline
+        return self.state in (
+            LayerState.LOADING,
+            LayerState.LOADED,
+            LayerState.UNLOADED,
+        )
 
     def setBlendModeByName(self, modeName):
         self.blendModeName = modeName
@@ -579,57 +740,6 @@ class FreehandRasterGeoreferencerLayer(QgsPluginLayer):
         self.transparency = transparency
         self.setCustomProperty("transparency", transparency)
 
-    def draw(self, renderContext):
-        if renderContext.extent().isEmpty():
-            qDebug("Drawing is skipped because map extent is empty.")
-            return True
-
-        self.initializeLayer()
-        if not self.initialized:
-            qDebug("Drawing is skipped because nothing to draw.")
-            return True
-
-        painter = renderContext.painter()
-        painter.save()
-        self.prepareStyle(painter)
-        self.drawRaster(renderContext)
-        painter.restore()
-
-        return True
-
-    def drawRaster(self, renderContext):
-        painter = renderContext.painter()
-        painter.setRenderHint(QPainter.SmoothPixmapTransform, True)
-
-        self.map2pixel = renderContext.mapToPixel()
-
-        scaleX = self.xScale / self.map2pixel.mapUnitsPerPixel()
-        scaleY = self.yScale / self.map2pixel.mapUnitsPerPixel()
-
-        rect = QRectF(
-            QPointF(-self.image.width() / 2.0, -self.image.height() / 2.0),
-            QPointF(self.image.width() / 2.0, self.image.height() / 2.0),
-        )
-        mapCenter = self.map2pixel.transform(self.center)
-
-        # draw the image on the map canvas
-        painter.translate(QPointF(mapCenter.x(), mapCenter.y()))
-        painter.rotate(self.rotation)
-        painter.scale(scaleX, scaleY)
-        painter.drawImage(rect, self.image)
-
-        painter.setOpacity(1.0)
-        painter.setBrush(Qt.NoBrush)
-        pen = QPen()
-        pen.setColor(QColor(0, 0, 0))
-        pen.setWidth(3)
-        pen.setCosmetic(True)
-        painter.setPen(pen)
-        painter.drawRect(rect)
-
-    def prepareStyle(self, painter):
-        painter.setOpacity(1.0 - self.transparency / 100.0)
-
     def readXml(self, node, context):
         self.readCustomProperties(node)
         self.title = self.customProperty("title", "")
@@ -640,6 +750,10 @@ class FreehandRasterGeoreferencerLayer(QgsPluginLayer):
         xCenter = float(self.customProperty("xCenter", 0.0))
         yCenter = float(self.customProperty("yCenter", 0.0))
         self.center = QgsPointXY(xCenter, yCenter)
+        self.bands = utils.parseBands(self.customProperty("bands", ""))
+        # 0 if saved by an older version: known once initialized
+        self.imageWidth = int(self.customProperty("imageWidth", 0))
+        self.imageHeight = int(self.customProperty("imageHeight", 0))
         self.setTransparency(
             int(self.customProperty("transparency", LayerDefaultSettings.TRANSPARENCY))
         )
@@ -662,8 +776,17 @@ class FreehandRasterGeoreferencerLayer(QgsPluginLayer):
         filepath = self.getAbsoluteFilepath()
         filepath = os.path.normpath(filepath)
         lines.append(fmt % (self.tr("Path"), filepath))
-        lines.append(fmt % (self.tr("Image Width"), str(self.image.width())))
-        lines.append(fmt % (self.tr("Image Height"), str(self.image.height())))
+        lines.append(fmt % (self.tr("Image Width"), str(self.imageWidth)))
+        lines.append(fmt % (self.tr("Image Height"), str(self.imageHeight)))
+        if self.source is not None:
+            # levels and tiles in memory, image in a file if mapped
+            lines.append(
+                fmt
+                % (self.tr("Memory (resident)"), utils.formatBytes(self.memoryUsage()))
+            )
+            lines.append(
+                fmt % (self.tr("Memory (mapped)"), utils.formatBytes(self.mappedBytes))
+            )
         lines.append(fmt % (self.tr("Rotation (CW)"), str(self.rotation)))
         lines.append(fmt % (self.tr("X center"), str(self.center.x())))
         lines.append(fmt % (self.tr("Y center"), str(self.center.y())))
@@ -710,7 +833,11 @@ class FreehandRasterGeoreferencerLayerType(QgsPluginLayerType):
         )
         dialog.spinBox_Transparency.valueChanged.connect(layer.transparencyChanged)
 
-        dialog.exec_()
+        result = dialog.exec_()
+        if result == QDialog.Accepted:
+            bands = dialog.bands
+            if bands != layer.bands:
+                layer.setBands(bands)
 
         dialog.horizontalSlider_Transparency.valueChanged.disconnect(
             layer.transparencyChanged
@@ -738,13 +865,114 @@ class FreehandRasterGeoreferencerLayerRenderer(QgsMapLayerRenderer):
     """
     Custom renderer: in QGIS3 no implementation is provided for
     QgsPluginLayers
+
+    What is drawn is copied from the layer when the renderer is created: the
+    rendering (in a thread of QGIS) does not read the layer, which can be
+    modified meanwhile by the map tools
     """
 
-    def __init__(self, layer, rendererContext):
+    def __init__(self, layer, rendererContext, smooth=True):
         QgsMapLayerRenderer.__init__(self, layer.id())
-        self.layer = layer
         self.rendererContext = rendererContext
+        # if not, no smoothing and lower resolution: for navigation
+        self.smooth = smooth
+
+        self.isDrawable = layer.isDrawable() and not layer.isHiddenForGesture
+        self.center = QgsPointXY(layer.center)
+        self.rotation = layer.rotation
+        self.xScale = layer.xScale
+        self.yScale = layer.yScale
+        self.imageWidth = layer.imageWidth
+        self.imageHeight = layer.imageHeight
+        self.opacity = 1.0 - layer.transparency / 100.0
+        # a new source is set on the layer if loaded again: this one is not
+        # modified (except for its caches)
+        self.source = layer.source
+        # pixels of the image of the source if not owned by the image (numpy
+        # array or memory-mapped file): kept alive until the rendering ends,
+        # even if the layer frees them meanwhile
+        self.imageBuffer = layer.imageBuffer
 
     def render(self):
-        # same implementation as for QGIS2
-        return self.layer.draw(self.rendererContext)
+        renderContext = self.rendererContext
+        if renderContext.extent().isEmpty():
+            qDebug("Drawing is skipped because map extent is empty.")
+            return True
+
+        if not self.isDrawable:
+            qDebug("Drawing is skipped because nothing to draw.")
+            return True
+
+        painter = renderContext.painter()
+        painter.save()
+        painter.setOpacity(self.opacity)
+        self.drawRaster(renderContext)
+        painter.restore()
+
+        return True
+
+    def drawRaster(self, renderContext):
+        painter = renderContext.painter()
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, self.smooth)
+
+        map2pixel = renderContext.mapToPixel()
+
+        scaleX = self.xScale / map2pixel.mapUnitsPerPixel()
+        scaleY = self.yScale / map2pixel.mapUnitsPerPixel()
+
+        mapCenter = map2pixel.transform(self.center)
+
+        # origin at top left corner of image
+        transform = QTransform()
+        transform.translate(mapCenter.x(), mapCenter.y())
+        transform.rotate(self.rotation)
+        transform.scale(scaleX, scaleY)
+        transform.translate(-self.imageWidth / 2.0, -self.imageHeight / 2.0)
+
+        visibleRect = self.visibleImageRect(renderContext, transform)
+
+        # draw the image on the map canvas
+        # when zoomed out, a downsampled version of the image is drawn
+        # while loading, only the outline
+        painter.setTransform(transform, True)
+        if self.source is not None:
+            scale = max(abs(scaleX), abs(scaleY))
+            if not self.smooth:
+                # pyramid level twice smaller
+                scale /= 2
+            # stops early if the rendering is cancelled (map panned again...)
+            self.source.draw(
+                painter, visibleRect, scale, renderContext.renderingStopped
+            )
+        if renderContext.renderingStopped():
+            return
+
+        painter.setOpacity(1.0)
+        painter.setBrush(Qt.NoBrush)
+        pen = QPen()
+        pen.setColor(QColor(0, 0, 0))
+        pen.setWidth(3)
+        pen.setCosmetic(True)
+        painter.setPen(pen)
+        painter.drawRect(QRectF(0, 0, self.imageWidth, self.imageHeight))
+
+    def visibleImageRect(self, renderContext, transform):
+        """
+        Returns the part of the image (in image pixels) visible in the extent
+        of the render context
+        """
+        map2pixel = renderContext.mapToPixel()
+        extent = renderContext.extent()
+        corners = [
+            map2pixel.transform(x, y)
+            for x in (extent.xMinimum(), extent.xMaximum())
+            for y in (extent.yMinimum(), extent.yMaximum())
+        ]
+        xs = [corner.x() for corner in corners]
+        ys = [corner.y() for corner in corners]
+        viewRect = QRectF(QPointF(min(xs), min(ys)), QPointF(max(xs), max(ys)))
+
+        # bounding rect of the rotated view in image coordinates
+        inverted, _ = transform.inverted()
+        visibleRect = inverted.mapRect(viewRect)
+        return visibleRect.intersected(QRectF(0, 0, self.imageWidth, self.imageHeight))
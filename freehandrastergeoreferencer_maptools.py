@@ -12,7 +12,7 @@
 import math
 from operator import itemgetter
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtWidgets import QApplication, QInputDialog, QMessageBox
 from qgis.core import QgsGeometry, QgsPointXY, QgsWkbTypes
 from qgis.gui import QgsMapToolEmitPoint, QgsRubberBand
@@ -21,38 +21,37 @@ from .rastershadowmapcanvasitem import RasterShadowMapCanvasItem
 from .utils import tryfloat
 
 
-def isLayerVisible(iface, layer):
-    # TODO Really ???? See if there is something simpler
-    vl = iface.layerTreeView().layerTreeModel().rootGroup().findLayer(layer)
-    return vl.itemVisibilityChecked()
+class RasterMapTool(QgsMapToolEmitPoint):
+    """
+    Base of the map tools that transform the layer with a gesture (press,
+    move, release). Mouse moves are coalesced: only the latest position is
+    processed, at most once per frame (moveTo in subclasses).
+    """
 
+    # in ms
+    FRAME_INTERVAL = 16
 
-def setLayerVisible(iface, layer, visible):
-    vl = iface.layerTreeView().layerTreeModel().rootGroup().findLayer(layer)
-    vl.setItemVisibilityChecked(visible)
-
-
-class MoveRasterMapTool(QgsMapToolEmitPoint):
     def __init__(self, iface):
         self.iface = iface
         self.canvas = iface.mapCanvas()
         QgsMapToolEmitPoint.__init__(self, self.canvas)
 
         self.rasterShadow = RasterShadowMapCanvasItem(self.canvas)
-
-        self.rubberBandDisplacement = QgsRubberBand(
-            self.canvas, QgsWkbTypes.LineGeometry
-        )
-        self.rubberBandDisplacement.setColor(Qt.red)
-        self.rubberBandDisplacement.setWidth(1)
-
-        self.rubberBandExtent = QgsRubberBand(self.canvas, QgsWkbTypes.LineGeometry)
-        self.rubberBandExtent.setColor(Qt.red)
-        self.rubberBandExtent.setWidth(1)
-
-        self.isLayerVisible = True
-
-        self.reset()
+        self.rubberBands = []
+
+        # latest position of the mouse not processed yet
+        self.pendingPos = None
+        self.moveTimer = QTimer()
+        self.moveTimer.setSingleShot(True)
+        self.moveTimer.setInterval(self.FRAME_INTERVAL)
+        self.moveTimer.timeout.connect(self.processMove)
+
+    def createRubberBand(self, geometryType=QgsWkbTypes.LineGeometry, width=1):
+        rubberBand = QgsRubberBand(self.canvas, geometryType)
+        rubberBand.setColor(Qt.red)
+        rubberBand.setWidth(width)
+        self.rubberBands.append((rubberBand, geometryType))
+        return rubberBand
 
     def setLayer(self, layer):
         self.layer = layer
@@ -60,11 +59,73 @@ class MoveRasterMapTool(QgsMapToolEmitPoint):
     def reset(self):
         self.startPoint = self.endPoint = None
         self.isEmittingPoint = False
-        self.rubberBandDisplacement.reset(QgsWkbTypes.LineGeometry)
-        self.rubberBandExtent.reset(QgsWkbTypes.LineGeometry)
-        self.rasterShadow.reset()
+        self.moveTimer.stop()
+        self.pendingPos = None
+        self.resetFeedback()
         self.layer = None
 
+    def resetFeedback(self, keep=()):
+        # rubber bands and shadow, except the rubber bands in keep
+        for rubberBand, geometryType in self.rubberBands:
+            if rubberBand not in keep:
+                rubberBand.reset(geometryType)
+        self.rasterShadow.reset()
+
+    def canvasMoveEvent(self, e):
+        if not self.isEmittingPoint:
+            return
+
+        self.pendingPos = e.pos()
+        if not self.moveTimer.isActive():
+            self.moveTimer.start()
+
+    def processMove(self):
+        pos = self.pendingPos
+        self.pendingPos = None
+        if pos is None or not self.isEmittingPoint:
+            return
+        self.moveTo(pos)
+
+    def flushMove(self):
+        # before using the end point of the gesture
+        self.moveTimer.stop()
+        self.processMove()
+
+    def moveTo(self, pos):
+        # feedback of the gesture at pos: nothing by default
+        pass
+
+    def hideLayer(self):
+        # only the shadow is displayed during the gesture
+        self.layer.setHiddenForGesture(True)
+
+    def commitLayer(self):
+        # at the end of the gesture, once the transform parameters are set
+        self.layer.setHiddenForGesture(False)
+
+        self.layer.commitTransformParameters()
+
+    def showPolyline(self, rubberBand, points):
+        rubberBand.reset(QgsWkbTypes.LineGeometry)
+        for point in points[:-1]:
+            rubberBand.addPoint(point, False)
+        rubberBand.addPoint(points[-1], True)  # true to update canvas
+        rubberBand.show()
+
+    def showExtent(self, cornerPoints):
+        # closed
+        self.showPolyline(self.rubberBandExtent, cornerPoints + [cornerPoints[0]])
+
+
+class MoveRasterMapTool(RasterMapTool):
+    def __init__(self, iface):
+        RasterMapTool.__init__(self, iface)
+
+        self.rubberBandDisplacement = self.createRubberBand()
+        self.rubberBandExtent = self.createRubberBand()
+
+        self.reset()
+
     def canvasPressEvent(self, e):
         self.startPoint = self.toMapCoordinates(e.pos())
         self.endPoint = self.startPoint
@@ -76,102 +137,64 @@ class MoveRasterMapTool(QgsMapToolEmitPoint):
             *self.layer.transformParameters()
         )
 
-        self.isLayerVisible = isLayerVisible(self.iface, self.layer)
-        setLayerVisible(self.iface, self.layer, False)
+        self.hideLayer()
 
         self.showDisplacement(self.startPoint, self.endPoint)
         self.layer.history.append({"action": "move", "center": self.layer.center})
 
     def canvasReleaseEvent(self, e):
+        self.flushMove()
         self.isEmittingPoint = False
 
-        self.rubberBandDisplacement.reset(QgsWkbTypes.LineGeometry)
-        self.rubberBandExtent.reset(QgsWkbTypes.LineGeometry)
-        self.rasterShadow.reset()
+        self.resetFeedback()
 
         x = self.originalCenter.x() + self.endPoint.x() - self.startPoint.x()
         y = self.originalCenter.y() + self.endPoint.y() - self.startPoint.y()
         self.layer.setCenter(QgsPointXY(x, y))
 
-        setLayerVisible(self.iface, self.layer, self.isLayerVisible)
-        self.layer.repaint()
-
-        self.layer.commitTransformParameters()
+        self.commitLayer()
 
-    def canvasMoveEvent(self, e):
-        if not self.isEmittingPoint:
-            return
-
-        self.endPoint = self.toMapCoordinates(e.pos())
+    def moveTo(self, pos):
+        self.endPoint = self.toMapCoordinates(pos)
         self.showDisplacement(self.startPoint, self.endPoint)
 
     def showDisplacement(self, startPoint, endPoint):
-        self.rubberBandDisplacement.reset(QgsWkbTypes.LineGeometry)
-        point1 = QgsPointXY(startPoint.x(), startPoint.y())
-        point2 = QgsPointXY(endPoint.x(), endPoint.y())
-        self.rubberBandDisplacement.addPoint(point1, False)
-        self.rubberBandDisplacement.addPoint(point2, True)  # true to update canvas
-        self.rubberBandDisplacement.show()
-
-        self.rubberBandExtent.reset(QgsWkbTypes.LineGeometry)
-        for point in self.originalCornerPoints:
-            self._addDisplacementToPoint(self.rubberBandExtent, point, False)
-        # for closing
-        self._addDisplacementToPoint(
-            self.rubberBandExtent, self.originalCornerPoints[0], True
+        self.showPolyline(
+            self.rubberBandDisplacement,
+            [
+                QgsPointXY(startPoint.x(), startPoint.y()),
+                QgsPointXY(endPoint.x(), endPoint.y()),
+            ],
         )
-        self.rubberBandExtent.show()
 
-        self.rasterShadow.reset(self.layer)
-        self.rasterShadow.setDeltaDisplacement(
-            self.endPoint.x() - self.startPoint.x(),
-            self.endPoint.y() - self.startPoint.y(),
-            True,
+        dx = endPoint.x() - startPoint.x()
+        dy = endPoint.y() - startPoint.y()
+        self.showExtent(
+            [
+                QgsPointXY(point.x() + dx, point.y() + dy)
+                for point in self.originalCornerPoints
+            ]
         )
-        self.rasterShadow.show()
 
-    def _addDisplacementToPoint(self, rubberBand, point, doUpdate):
-        x = point.x() + self.endPoint.x() - self.startPoint.x()
-        y = point.y() + self.endPoint.y() - self.startPoint.y()
-        self.rubberBandExtent.addPoint(QgsPointXY(x, y), doUpdate)
+        self.rasterShadow.reset(self.layer)
+        self.rasterShadow.setDeltaDisplacement(dx, dy, True)
+        self.rasterShadow.show()
 
 
 # move the mouse in the Y axis to rotate
 
 
-class RotateRasterMapTool(QgsMapToolEmitPoint):
+class RotateRasterMapTool(RasterMapTool):
     def __init__(self, iface):
-        self.iface = iface
-        self.canvas = iface.mapCanvas()
-        QgsMapToolEmitPoint.__init__(self, self.canvas)
-
-        self.rasterShadow = RasterShadowMapCanvasItem(self.canvas)
-
-        self.rubberBandExtent = QgsRubberBand(self.canvas, QgsWkbTypes.LineGeometry)
-        self.rubberBandExtent.setColor(Qt.red)
-        self.rubberBandExtent.setWidth(1)
+        RasterMapTool.__init__(self, iface)
 
+        self.rubberBandExtent = self.createRubberBand()
         # In case of rotation around pressed point (ctrl)
         # Use rubberBand for displaying an horizontal line.
-        self.rubberBandDisplacement = QgsRubberBand(
-            self.canvas, QgsWkbTypes.LineGeometry
-        )
-        self.rubberBandDisplacement.setColor(Qt.red)
-        self.rubberBandDisplacement.setWidth(1)
+        self.rubberBandDisplacement = self.createRubberBand()
 
         self.reset()
 
-    def setLayer(self, layer):
-        self.layer = layer
-
-    def reset(self):
-        self.startPoint = self.endPoint = None
-        self.isEmittingPoint = False
-        self.rubberBandExtent.reset(QgsWkbTypes.LineGeometry)
-        self.rubberBandDisplacement.reset(QgsWkbTypes.LineGeometry)
-        self.rasterShadow.reset()
-        self.layer = None
-
     def canvasPressEvent(self, e):
         self.startY = e.pos().y()
         self.endY = self.startY
@@ -183,8 +206,7 @@ class RotateRasterMapTool(QgsMapToolEmitPoint):
         self.startPoint = self.toMapCoordinates(e.pos())
         self.endPoint = self.startPoint
 
-        self.isLayerVisible = isLayerVisible(self.iface, self.layer)
-        setLayerVisible(self.iface, self.layer, False)
+        self.hideLayer()
 
         rotation = self.computeRotation()
         self.showRotation(rotation)
@@ -198,11 +220,10 @@ class RotateRasterMapTool(QgsMapToolEmitPoint):
         )  # rotation set
 
     def canvasReleaseEvent(self, e):
+        self.flushMove()
         self.isEmittingPoint = False
 
-        self.rubberBandExtent.reset(QgsWkbTypes.LineGeometry)
-        self.rubberBandDisplacement.reset(QgsWkbTypes.LineGeometry)
-        self.rasterShadow.reset()
+        self.resetFeedback()
 
         rotation = self.computeRotation()
         if self.isRotationAroundPoint:
@@ -211,21 +232,14 @@ class RotateRasterMapTool(QgsMapToolEmitPoint):
 
         self.layer.setRotation(val)
 
-        setLayerVisible(self.iface, self.layer, self.isLayerVisible)
-        self.layer.repaint()
+        self.commitLayer()
 
-        self.layer.commitTransformParameters()
-
-    def canvasMoveEvent(self, e):
-        if not self.isEmittingPoint:
-            return
-
-        self.endY = e.pos().y()
+    def moveTo(self, pos):
+        self.endY = pos.y()
+        self.endPoint = self.toMapCoordinates(pos)
         rotation = self.computeRotation()
         self.showRotation(rotation)
 
-        self.endPoint = self.toMapCoordinates(e.pos())
-
     def computeRotation(self):
         if self.isRotationAroundPoint:
             dX = self.endPoint.x() - self.startPoint.x()
@@ -245,14 +259,14 @@ class RotateRasterMapTool(QgsMapToolEmitPoint):
             self.rasterShadow.setDeltaRotationFromPoint(rotation, self.startPoint, True)
             self.rasterShadow.show()
 
-            self.rubberBandDisplacement.reset(QgsWkbTypes.LineGeometry)
-            point0 = QgsPointXY(self.startPoint.x() + 10, self.startPoint.y())
-            point1 = QgsPointXY(self.startPoint.x(), self.startPoint.y())
-            point2 = QgsPointXY(self.endPoint.x(), self.endPoint.y())
-            self.rubberBandDisplacement.addPoint(point0, False)
-            self.rubberBandDisplacement.addPoint(point1, False)
-            self.rubberBandDisplacement.addPoint(point2, True)  # true to update canvas
-            self.rubberBandDisplacement.show()
+            self.showPolyline(
+                self.rubberBandDisplacement,
+                [
+                    QgsPointXY(self.startPoint.x() + 10, self.startPoint.y()),
+                    QgsPointXY(self.startPoint.x(), self.startPoint.y()),
+                    QgsPointXY(self.endPoint.x(), self.endPoint.y()),
+                ],
+            )
         else:
             center, originalRotation, xScale, yScale = self.layer.transformParameters()
             newRotation = rotation + originalRotation
@@ -264,40 +278,19 @@ class RotateRasterMapTool(QgsMapToolEmitPoint):
             self.rasterShadow.setDeltaRotation(rotation, True)
             self.rasterShadow.show()
 
-        self.rubberBandExtent.reset(QgsWkbTypes.LineGeometry)
-        for point in cornerPoints:
-            self.rubberBandExtent.addPoint(point, False)
-        # for closing
-        self.rubberBandExtent.addPoint(cornerPoints[0], True)
-        self.rubberBandExtent.show()
+        self.showExtent(list(cornerPoints))
 
 
 # move the map in x or y axis to scale in x or y dimensions of the
 # image (no rotation of the coordinate system)
-class ScaleRasterMapTool(QgsMapToolEmitPoint):
+class ScaleRasterMapTool(RasterMapTool):
     def __init__(self, iface):
-        self.iface = iface
-        self.canvas = iface.mapCanvas()
-        QgsMapToolEmitPoint.__init__(self, self.canvas)
+        RasterMapTool.__init__(self, iface)
 
-        self.rasterShadow = RasterShadowMapCanvasItem(self.canvas)
-
-        self.rubberBandExtent = QgsRubberBand(self.canvas, QgsWkbTypes.LineGeometry)
-        self.rubberBandExtent.setColor(Qt.red)
-        self.rubberBandExtent.setWidth(1)
+        self.rubberBandExtent = self.createRubberBand()
 
         self.reset()
 
-    def setLayer(self, layer):
-        self.layer = layer
-
-    def reset(self):
-        self.startPoint = self.endPoint = None
-        self.isEmittingPoint = False
-        self.rubberBandExtent.reset(QgsWkbTypes.LineGeometry)
-        self.rasterShadow.reset()
-        self.layer = None
-
     def canvasPressEvent(self, e):
         pressed_button = e.button()
         if pressed_button == 1:
@@ -310,8 +303,7 @@ class ScaleRasterMapTool(QgsMapToolEmitPoint):
             modifiers = QApplication.keyboardModifiers()
             self.isKeepRelativeScale = bool(modifiers & Qt.ControlModifier)
 
-            self.isLayerVisible = isLayerVisible(self.iface, self.layer)
-            setLayerVisible(self.iface, self.layer, False)
+            self.hideLayer()
 
             scaling = self.computeScaling()
             self.showScaling(*scaling)
@@ -326,15 +318,15 @@ class ScaleRasterMapTool(QgsMapToolEmitPoint):
     def canvasReleaseEvent(self, e):
         pressed_button = e.button()
         if pressed_button == 1:
+            self.flushMove()
             self.isEmittingPoint = False
 
-            self.rubberBandExtent.reset(QgsWkbTypes.LineGeometry)
-            self.rasterShadow.reset()
+            self.resetFeedback()
 
             xScale, yScale = self.computeScaling()
             self.layer.setScale(xScale * self.layer.xScale, yScale * self.layer.yScale)
 
-            setLayerVisible(self.iface, self.layer, self.isLayerVisible)
+            self.layer.setHiddenForGesture(False)
         elif pressed_button == 2:
             number, ok = QInputDialog.getText(
                 None, "Scale & DPI", "Enter scale,dpi (e.g. 3000,96)"
@@ -368,11 +360,8 @@ class ScaleRasterMapTool(QgsMapToolEmitPoint):
         self.layer.repaint()
         self.layer.commitTransformParameters()
 
-    def canvasMoveEvent(self, e):
-        if not self.isEmittingPoint:
-            return
-
-        self.endPoint = e.pos()
+    def moveTo(self, pos):
+        self.endPoint = pos
         scaling = self.computeScaling()
         self.showScaling(*scaling)
 
@@ -401,47 +390,22 @@ class ScaleRasterMapTool(QgsMapToolEmitPoint):
             center, rotation, newXScale, newYScale
         )
 
-        self.rubberBandExtent.reset(QgsWkbTypes.LineGeometry)
-        for point in cornerPoints:
-            self.rubberBandExtent.addPoint(point, False)
-        # for closing
-        self.rubberBandExtent.addPoint(cornerPoints[0], True)
-        self.rubberBandExtent.show()
+        self.showExtent(list(cornerPoints))
 
         self.rasterShadow.reset(self.layer)
         self.rasterShadow.setDeltaScale(xScale, yScale, True)
         self.rasterShadow.show()
 
 
-class AdjustRasterMapTool(QgsMapToolEmitPoint):
+class AdjustRasterMapTool(RasterMapTool):
     def __init__(self, iface):
-        self.iface = iface
-        self.canvas = iface.mapCanvas()
-        QgsMapToolEmitPoint.__init__(self, self.canvas)
-
-        self.rasterShadow = RasterShadowMapCanvasItem(self.canvas)
-
-        self.rubberBandExtent = QgsRubberBand(self.canvas, QgsWkbTypes.LineGeometry)
-        self.rubberBandExtent.setColor(Qt.red)
-        self.rubberBandExtent.setWidth(1)
+        RasterMapTool.__init__(self, iface)
 
-        self.rubberBandAdjustSide = QgsRubberBand(self.canvas, QgsWkbTypes.LineGeometry)
-        self.rubberBandAdjustSide.setColor(Qt.red)
-        self.rubberBandAdjustSide.setWidth(3)
+        self.rubberBandExtent = self.createRubberBand()
+        self.rubberBandAdjustSide = self.createRubberBand(width=3)
 
         self.reset()
 
-    def setLayer(self, layer):
-        self.layer = layer
-
-    def reset(self):
-        self.startPoint = self.endPoint = None
-        self.isEmittingPoint = False
-        self.rubberBandExtent.reset(QgsWkbTypes.LineGeometry)
-        self.rubberBandAdjustSide.reset(QgsWkbTypes.LineGeometry)
-        self.rasterShadow.reset()
-        self.layer = None
-
     def canvasPressEvent(self, e):
         # find the side of the rectangle closest to the click and some data
         # necessary to compute the new cneter and scale
@@ -470,8 +434,7 @@ class AdjustRasterMapTool(QgsMapToolEmitPoint):
         self.endPoint = self.startPoint
         self.isEmittingPoint = True
 
-        self.isLayerVisible = isLayerVisible(self.iface, self.layer)
-        setLayerVisible(self.iface, self.layer, False)
+        self.hideLayer()
 
         adjustment = self.computeAdjustment()
         self.showAdjustment(*adjustment)
@@ -508,26 +471,19 @@ class AdjustRasterMapTool(QgsMapToolEmitPoint):
         return math.sqrt((pt1.x() - pt2.x()) ** 2 + (pt1.y() - pt2.y()) ** 2)
 
     def canvasReleaseEvent(self, e):
+        self.flushMove()
         self.isEmittingPoint = False
 
-        self.rubberBandExtent.reset(QgsWkbTypes.LineGeometry)
-        self.rubberBandAdjustSide.reset(QgsWkbTypes.LineGeometry)
-        self.rasterShadow.reset()
+        self.resetFeedback()
 
         center, xScale, yScale = self.computeAdjustment()
         self.layer.setCenter(center)
         self.layer.setScale(xScale * self.layer.xScale, yScale * self.layer.yScale)
 
-        setLayerVisible(self.iface, self.layer, self.isLayerVisible)
-        self.layer.repaint()
-
-        self.layer.commitTransformParameters()
-
-    def canvasMoveEvent(self, e):
-        if not self.isEmittingPoint:
-            return
+        self.commitLayer()
 
-        self.endPoint = self.toMapCoordinates(e.pos())
+    def moveTo(self, pos):
+        self.endPoint = self.toMapCoordinates(pos)
 
         adjustment = self.computeAdjustment()
         self.showAdjustment(*adjustment)
@@ -566,20 +522,18 @@ class AdjustRasterMapTool(QgsMapToolEmitPoint):
             center, rotation, newXScale, newYScale
         )
 
-        self.rubberBandExtent.reset(QgsWkbTypes.LineGeometry)
-        for point in cornerPoints:
-            self.rubberBandExtent.addPoint(point, False)
-        # for closing
-        self.rubberBandExtent.addPoint(cornerPoints[0], True)
-        self.rubberBandExtent.show()
+        self.showExtent(list(cornerPoints))
 
         # show rubberband for side
         # see def of indexSide in init:
         # cornerpoints are (topLeft, topRight, bottomRight, bottomLeft)
-        self.rubberBandAdjustSide.reset(QgsWkbTypes.LineGeometry)
-        self.rubberBandAdjustSide.addPoint(cornerPoints[self.indexSide % 4], False)
-        self.rubberBandAdjustSide.addPoint(cornerPoints[(self.indexSide + 1) % 4], True)
-        self.rubberBandAdjustSide.show()
+        self.showPolyline(
+            self.rubberBandAdjustSide,
+            [
+                cornerPoints[self.indexSide % 4],
+                cornerPoints[(self.indexSide + 1) % 4],
+            ],
+        )
 
         self.rasterShadow.reset(self.layer)
         dx = center.x() - self.layer.center.x()
@@ -589,47 +543,23 @@ class AdjustRasterMapTool(QgsMapToolEmitPoint):
         self.rasterShadow.show()
 
 
-class GeorefRasterBy2PointsMapTool(QgsMapToolEmitPoint):
+class GeorefRasterBy2PointsMapTool(RasterMapTool):
     def __init__(self, iface):
-        self.iface = iface
-        self.canvas = iface.mapCanvas()
-        QgsMapToolEmitPoint.__init__(self, self.canvas)
-
-        self.rasterShadow = RasterShadowMapCanvasItem(self.canvas)
+        RasterMapTool.__init__(self, iface)
 
         self.firstPoint = None
 
-        self.rubberBandOrigin = QgsRubberBand(self.canvas, QgsWkbTypes.PointGeometry)
-        self.rubberBandOrigin.setColor(Qt.red)
+        self.rubberBandOrigin = self.createRubberBand(QgsWkbTypes.PointGeometry, 2)
         self.rubberBandOrigin.setIcon(QgsRubberBand.ICON_CIRCLE)
         self.rubberBandOrigin.setIconSize(7)
-        self.rubberBandOrigin.setWidth(2)
-
-        self.rubberBandDisplacement = QgsRubberBand(
-            self.canvas, QgsWkbTypes.LineGeometry
-        )
-        self.rubberBandDisplacement.setColor(Qt.red)
-        self.rubberBandDisplacement.setWidth(1)
-
-        self.rubberBandExtent = QgsRubberBand(self.canvas, QgsWkbTypes.LineGeometry)
-        self.rubberBandExtent.setColor(Qt.red)
-        self.rubberBandExtent.setWidth(2)
-
-        self.isLayerVisible = True
+        self.rubberBandDisplacement = self.createRubberBand()
+        self.rubberBandExtent = self.createRubberBand(width=2)
 
         self.reset()
 
-    def setLayer(self, layer):
-        self.layer = layer
-
     def reset(self):
-        self.startPoint = self.endPoint = self.firstPoint = None
-        self.isEmittingPoint = False
-        self.rubberBandOrigin.reset(QgsWkbTypes.PointGeometry)
-        self.rubberBandDisplacement.reset(QgsWkbTypes.LineGeometry)
-        self.rubberBandExtent.reset(QgsWkbTypes.LineGeometry)
-        self.rasterShadow.reset()
-        self.layer = None
+        RasterMapTool.reset(self)
+        self.firstPoint = None
 
     def deactivate(self):
         QgsMapToolEmitPoint.deactivate(self)
@@ -647,8 +577,7 @@ class GeorefRasterBy2PointsMapTool(QgsMapToolEmitPoint):
                 *self.layer.transformParameters()
             )
 
-            self.isLayerVisible = isLayerVisible(self.iface, self.layer)
-            setLayerVisible(self.iface, self.layer, False)
+            self.hideLayer()
 
             self.showDisplacement(self.startPoint, self.endPoint)
             self.layer.history.append(
@@ -663,8 +592,7 @@ class GeorefRasterBy2PointsMapTool(QgsMapToolEmitPoint):
             self.isEmittingPoint = True
             self.height = self.canvas.height()
 
-            self.isLayerVisible = isLayerVisible(self.iface, self.layer)
-            setLayerVisible(self.iface, self.layer, False)
+            self.hideLayer()
 
             rotation = self.computeRotation()
             xScale = yScale = self.computeScale()
@@ -680,11 +608,11 @@ class GeorefRasterBy2PointsMapTool(QgsMapToolEmitPoint):
             )
 
     def canvasReleaseEvent(self, e):
+        self.flushMove()
         self.isEmittingPoint = False
 
-        self.rubberBandDisplacement.reset(QgsWkbTypes.LineGeometry)
-        self.rubberBandExtent.reset(QgsWkbTypes.LineGeometry)
-        self.rasterShadow.reset()
+        # origin kept for the second point
+        self.resetFeedback(keep=(self.rubberBandOrigin,))
 
         if self.firstPoint is None:
             x = self.originalCenter.x() + self.endPoint.x() - self.startPoint.x()
@@ -692,10 +620,7 @@ class GeorefRasterBy2PointsMapTool(QgsMapToolEmitPoint):
             self.layer.setCenter(QgsPointXY(x, y))
             self.firstPoint = self.endPoint
 
-            setLayerVisible(self.iface, self.layer, self.isLayerVisible)
-            self.layer.repaint()
-
-            self.layer.commitTransformParameters()
+            self.commitLayer()
         else:
             rotation = self.computeRotation()
             xScale = yScale = self.computeScale()
@@ -705,29 +630,20 @@ class GeorefRasterBy2PointsMapTool(QgsMapToolEmitPoint):
             self.layer.setRotation(self.layer.rotation + rotation)
             self.layer.setScale(self.layer.xScale * xScale, self.layer.yScale * yScale)
 
-            setLayerVisible(self.iface, self.layer, self.isLayerVisible)
-            self.layer.repaint()
+            self.commitLayer()
 
-            self.layer.commitTransformParameters()
-
-            self.rubberBandDisplacement.reset(QgsWkbTypes.LineGeometry)
-            self.rubberBandExtent.reset(QgsWkbTypes.LineGeometry)
-            self.rubberBandOrigin.reset(QgsWkbTypes.PointGeometry)
-            self.rasterShadow.reset()
+            self.resetFeedback()
 
             self.firstPoint = None
             self.startPoint = self.endPoint = None
 
-    def canvasMoveEvent(self, e):
-        if not self.isEmittingPoint:
-            return
-
-        self.endPoint = self.toMapCoordinates(e.pos())
+    def moveTo(self, pos):
+        self.endPoint = self.toMapCoordinates(pos)
 
         if self.firstPoint is None:
             self.showDisplacement(self.startPoint, self.endPoint)
         else:
-            self.endY = e.pos().y()
+            self.endY = pos.y()
             rotation = self.computeRotation()
             xScale = yScale = self.computeScale()
             self.showRotationScale(rotation, xScale, yScale)
@@ -757,11 +673,7 @@ class GeorefRasterBy2PointsMapTool(QgsMapToolEmitPoint):
             self.firstPoint, rotation, xScale, yScale
         )
 
-        self.rubberBandExtent.reset(QgsWkbTypes.LineGeometry)
-        for point in cornerPoints:
-            self.rubberBandExtent.addPoint(point, False)
-        self.rubberBandExtent.addPoint(cornerPoints[0], True)
-        self.rubberBandExtent.show()
+        self.showExtent(list(cornerPoints))
 
         # Calculate the displacement of the center due to the rotation from
         # another point.
@@ -773,45 +685,37 @@ class GeorefRasterBy2PointsMapTool(QgsMapToolEmitPoint):
         self.rasterShadow.setDeltaRotation(rotation, True)
         self.rasterShadow.show()
 
-        self.rubberBandDisplacement.reset(QgsWkbTypes.LineGeometry)
-        point0 = QgsPointXY(self.startPoint.x(), self.startPoint.y())
-        point1 = QgsPointXY(self.firstPoint.x(), self.firstPoint.y())
-        point2 = QgsPointXY(self.endPoint.x(), self.endPoint.y())
-        self.rubberBandDisplacement.addPoint(point0, False)
-        self.rubberBandDisplacement.addPoint(point1, False)
-        self.rubberBandDisplacement.addPoint(point2, True)  # true to update canvas
-        self.rubberBandDisplacement.show()
+        self.showPolyline(
+            self.rubberBandDisplacement,
+            [
+                QgsPointXY(self.startPoint.x(), self.startPoint.y()),
+                QgsPointXY(self.firstPoint.x(), self.firstPoint.y()),
+                QgsPointXY(self.endPoint.x(), self.endPoint.y()),
+            ],
+        )
 
     def showDisplacement(self, startPoint, endPoint):
         self.rubberBandOrigin.reset(QgsWkbTypes.PointGeometry)
         self.rubberBandOrigin.addPoint(endPoint, True)
         self.rubberBandOrigin.show()
 
-        self.rubberBandDisplacement.reset(QgsWkbTypes.LineGeometry)
-        point1 = QgsPointXY(startPoint.x(), startPoint.y())
-        point2 = QgsPointXY(endPoint.x(), endPoint.y())
-        self.rubberBandDisplacement.addPoint(point1, False)
-        self.rubberBandDisplacement.addPoint(point2, True)  # true to update canvas
-        self.rubberBandDisplacement.show()
-
-        self.rubberBandExtent.reset(QgsWkbTypes.LineGeometry)
-        for point in self.originalCornerPoints:
-            self._addDisplacementToPoint(self.rubberBandExtent, point, False)
-        # for closing
-        self._addDisplacementToPoint(
-            self.rubberBandExtent, self.originalCornerPoints[0], True
+        self.showPolyline(
+            self.rubberBandDisplacement,
+            [
+                QgsPointXY(startPoint.x(), startPoint.y()),
+                QgsPointXY(endPoint.x(), endPoint.y()),
+            ],
         )
-        self.rubberBandExtent.show()
 
-        self.rasterShadow.reset(self.layer)
-        self.rasterShadow.setDeltaDisplacement(
-            self.endPoint.x() - self.startPoint.x(),
-            self.endPoint.y() - self.startPoint.y(),
-            True,
+        dx = endPoint.x() - startPoint.x()
+        dy = endPoint.y() - startPoint.y()
+        self.showExtent(
+            [
+                QgsPointXY(point.x() + dx, point.y() + dy)
+                for point in self.originalCornerPoints
+            ]
         )
-        self.rasterShadow.show()
 
-    def _addDisplacementToPoint(self, rubberBand, point, doUpdate):
-        x = point.x() + self.endPoint.x() - self.startPoint.x()
-        y = point.y() + self.endPoint.y() - self.startPoint.y()
-        self.rubberBandExtent.addPoint(QgsPointXY(x, y), doUpdate)
+        self.rasterShadow.reset(self.layer)
+        self.rasterShadow.setDeltaDisplacement(dx, dy, True)
+        self.rasterShadow.show()
@@ -1,9 +1,32 @@
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import os
+import tempfile
+import uuid
+
 import numpy as np
 from osgeo import gdal
 
+# number of pixels converted at once: bounds the temporary arrays
+CHUNK_PIXELS = 1 << 20
+# for percentile clipping
+HISTOGRAM_BUCKETS = 1024
+# output formats of the export by extension
+EXPORT_DRIVERS = {"tif": "GTiff", "png": "PNG", "jpg": "JPEG", "bmp": "BMP"}
+GEOTIFF_BLOCK_SIZE = 512
+# of the exported GeoTIFF, if in the GDAL build (see gtiff_compressions)
+GTIFF_COMPRESSIONS = ["DEFLATE", "ZSTD", "LZW", "JPEG", "NONE"]
+# sidecar files that would override the georeferencing embedded in a GeoTIFF
+GTIFF_STALE_SIDECARS = (".tfw", ".tifw", ".wld")
+# memory of the warper for the export, in bytes
+WARP_MEMORY = 256 * 1024 * 1024
+
 
 def format(filepath):
+    # None if not read by GDAL
     dataset = gdal.Open(filepath, gdal.GA_ReadOnly)
+    if dataset is None:
+        return None
     cols = dataset.RasterXSize
     rows = dataset.RasterYSize
     bands = dataset.RasterCount
@@ -15,20 +38,495 @@ def format(filepath):
     return bands, bandtype, cols, rows
 
 
-def pixels(filepath):
+def is_plain_byte(filepath):
+    """
+    If the pixels of the file are displayed as is (gray or RGB, 8 bits, no
+    color table), so they can be read by GDAL instead of Qt
+    """
+    dataset = gdal.Open(filepath, gdal.GA_ReadOnly)
+    if dataset is None or dataset.RasterCount not in (1, 3):
+        return False
+    for i in range(1, dataset.RasterCount + 1):
+        band = dataset.GetRasterBand(i)
+        if band.DataType != gdal.GDT_Byte or band.GetColorTable() is not None:
+            return False
+        nbits = band.GetMetadataItem("NBITS", "IMAGE_STRUCTURE")
+        if nbits is not None and int(nbits) < 8:
+            return False
+    return True
+
+
+def raster_size(filepath):
+    """
+    (cols, rows), None if GDAL cannot read the raster
+    """
+    dataset = gdal.Open(filepath, gdal.GA_ReadOnly)
+    if dataset is None or dataset.RasterCount == 0:
+        return None
+    return dataset.RasterXSize, dataset.RasterYSize
+
+
+def overview_count(filepath):
+    dataset = gdal.Open(filepath, gdal.GA_ReadOnly)
+    if dataset is None or dataset.RasterCount == 0:
+        return 0
+    return dataset.GetRasterBand(1).GetOverviewCount()
+
+
+def build_overviews(filepath, progress=None, min_size=256):
+    """
+    Builds external overviews (.ovr) down to min_size pixels. progress is
+    called with the completed fraction and returns False to cancel. Returns
+    False if cancelled, raises RuntimeError if failed
+    """
+    # read only: external overviews
+    dataset = gdal.Open(filepath, gdal.GA_ReadOnly)
+    if dataset is None:
+        raise RuntimeError(gdal.GetLastErrorMsg())
+    return _build_overviews(dataset, progress, min_size)
+
+
+def _build_overviews(dataset, progress=None, min_size=256):
+    # False if cancelled, raises RuntimeError if failed
+    levels = []
+    factor = 2
+    while max(dataset.RasterXSize, dataset.RasterYSize) / factor >= min_size:
+        levels.append(factor)
+        factor *= 2
+    if not levels:
+        return True
+
+    cancelled = []
+
+    def callback(complete, message, data):
+        if progress is None or progress(complete):
+            return 1
+        cancelled.append(True)
+        return 0
+
+    result = dataset.BuildOverviews("AVERAGE", levels, callback)
+    dataset = None
+    if result == gdal.CE_None:
+        return True
+    if cancelled:
+        return False
+    raise RuntimeError(gdal.GetLastErrorMsg())
+
+
+def band_range(band, percent_clip=0):
+    # approximate is enough for display
+    min_, max_ = band.ComputeRasterMinMax(True)
+    if percent_clip > 0 and max_ > min_:
+        # cut percent_clip % of the values on each side
+        histogram = band.GetHistogram(min_, max_, HISTOGRAM_BUCKETS, 0, 1)
+        cumulated = np.cumsum(histogram)
+        total = cumulated[-1]
+        if total > 0:
+            bucket_width = (max_ - min_) / HISTOGRAM_BUCKETS
+            low = np.searchsorted(cumulated, total * percent_clip / 100.0)
+            high = np.searchsorted(cumulated, total * (1 - percent_clip / 100.0))
+            min_, max_ = (
+                min_ + low * bucket_width,
+                min_ + min(high + 1, HISTOGRAM_BUCKETS) * bucket_width,
+            )
+    return min_, max_
+
+
+@functools.lru_cache(maxsize=16)
+def _lut(dtype_str, min_, max_):
+    # for all the values of an integer type of at most 16 bits, indexed by
+    # the unsigned view of the values
+    dtype = np.dtype(dtype_str)
+    unsigned = np.dtype("u%d" % dtype.itemsize)
+    values = np.arange(2 ** (8 * dtype.itemsize), dtype=unsigned).view(dtype)
+    values = 255.0 * (np.clip(values, min_, max_) - min_) / (max_ - min_)
+    return values.astype(np.uint8), unsigned
+
+
+def to_byte(data, min_=None, max_=None, out=None):
+    if min_ is None or max_ is None:
+        min_ = np.min(data)
+        max_ = np.max(data)
+    min_ = float(min_)
+    max_ = float(max_)
+    if max_ <= min_:
+        # constant
+        max_ = min_ + 1
+    if out is None:
+        out = np.empty(data.shape, dtype=np.uint8)
+
+    lut = None
+    if data.dtype.kind in "iu" and data.dtype.itemsize <= 2:
+        lut, unsigned = _lut(data.dtype.str, min_, max_)
+
+    # by chunks of rows so the temporary arrays stay small
+    chunk_rows = max(1, CHUNK_PIXELS // max(1, data.shape[-1]))
+    for start in range(0, data.shape[0], chunk_rows):
+        chunk = data[start : start + chunk_rows]
+        if lut is not None:
+            out[start : start + chunk_rows] = lut[chunk.view(unsigned)]
+        else:
+            chunk = np.clip(chunk, min_, max_).astype(np.float64)
+            chunk -= min_
+            chunk *= 255.0 / (max_ - min_)
+            out[start : start + chunk_rows] = chunk
+    return out
+
+
+def band_to_byte(filepath, band_index, out, percent_clip=0, is_cancelled=None):
+    """
+    Reads the band by chunks into out, stretched to Byte if needed. Returns
+    False if is_cancelled returned True (out partially written)
+    """
+    # own dataset: a GDAL dataset cannot be shared between threads
+    dataset = gdal.Open(filepath, gdal.GA_ReadOnly)
+    band = dataset.GetRasterBand(band_index)
+    cols = band.XSize
+    rows = band.YSize
+    is_byte = band.DataType == gdal.GDT_Byte
+    if not is_byte:
+        min_, max_ = band_range(band, percent_clip)
+    # read whole blocks of the file
+    _, block_rows = band.GetBlockSize()
+    chunk_rows = max(1, CHUNK_PIXELS // cols)
+    if block_rows < chunk_rows:
+        chunk_rows -= chunk_rows % block_rows
+    for yoff in range(0, rows, chunk_rows):
+        if is_cancelled is not None and is_cancelled():
+            return False
+        nrows = min(chunk_rows, rows - yoff)
+        if is_byte:
+            # as is
+            band.ReadAsArray(0, yoff, cols, nrows, buf_obj=out[yoff : yoff + nrows])
+        else:
+            data = band.ReadAsArray(0, yoff, cols, nrows)
+            to_byte(data, min_, max_, out=out[yoff : yoff + nrows])
+    return True
+
+
+def mapped_array(shape):
+    """
+    Byte array backed by a temporary file (deleted when closed), so it can be
+    paged out by the OS
+    """
+    with tempfile.TemporaryFile() as f:
+        # the mapping stays valid after the file is closed
+        return np.memmap(f, dtype=np.uint8, mode="w+", shape=shape)
+
+
+def image_buffer(rows, cols, nbands, mapped=False):
+    """
+    Byte buffer for a QImage with pixel interleaved bands and lines padded to
+    32 bits. Returns the buffer, the number of bytes per line and a
+    (rows, cols, nbands) view on the pixels
+    """
+    bytes_per_line = (cols * nbands + 3) // 4 * 4
+    if mapped:
+        buffer = mapped_array((rows, bytes_per_line))
+    else:
+        buffer = np.zeros((rows, bytes_per_line), dtype=np.uint8)
+    pixels = buffer[:, : cols * nbands].reshape((rows, cols, nbands))
+    return buffer, bytes_per_line, pixels
+
+
+def display_pixels(
+    filepath, band_indexes, percent_clip=0, mapped=False, is_cancelled=None
+):
+    """
+    Reads the bands, converted to Byte if needed, directly into a buffer for
+    a QImage (see image_buffer). Returns (buffer, bytes per line), None if
+    is_cancelled returned True
+    """
     dataset = gdal.Open(filepath, gdal.GA_ReadOnly)
     cols = dataset.RasterXSize
     rows = dataset.RasterYSize
-    data = dataset.ReadAsArray(0, 0, cols, rows)
-    if len(data.shape) == 2:
-        # monoband
-        data = data.reshape((1, *data.shape))
-    return data
-
-
-def to_byte(data):
-    min_ = np.min(data)
-    max_ = np.max(data)
-    data = 255.0 * (data - min_) / (max_ - min_)
-    data = data.astype(np.uint8)
-    return data
+    buffer, bytes_per_line, pixels = image_buffer(rows, cols, len(band_indexes), mapped)
+
+    # bands in parallel
+    workers = min(len(band_indexes), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                band_to_byte,
+                filepath,
+                band_index,
+                pixels[..., i],
+                percent_clip,
+                is_cancelled,
+            )
+            for i, band_index in enumerate(band_indexes)
+        ]
+        # raise exceptions of the workers
+        completed = [future.result() for future in futures]
+    if not all(completed):
+        return None
+    return buffer, bytes_per_line
+
+
+@functools.lru_cache(maxsize=None)
+def gtiff_compressions():
+    """
+    Compressions of GTIFF_COMPRESSIONS supported by the GTiff driver of the
+    GDAL build (ZSTD or JPEG can be missing)
+    """
+    option_list = (
+        gdal.GetDriverByName("GTiff").GetMetadataItem(gdal.DMD_CREATIONOPTIONLIST) or ""
+    )
+    return [
+        compression
+        for compression in GTIFF_COMPRESSIONS
+        if compression == "NONE" or "<Value>%s</Value>" % compression in option_list
+    ]
+
+
+def is_jpeg_compatible(datatype, nbands):
+    # JPEG in TIFF: 8 bits gray or RGB only
+    return datatype == "Byte" and nbands in (1, 3)
+
+
+def jpeg_quality(level):
+    # level 1 (fastest, largest) to 9 (slowest, smallest)
+    return 100 - 4 * level
+
+
+def creation_options(driver_name, compression, level, datatype, nbands):
+    """
+    Options of the exported raster. For GeoTIFF: tiled, compressed with
+    compression (name of GDAL) by all the cores, with the predictor suited
+    to datatype. level from 1 (fastest) to 9 (smallest)
+    """
+    if driver_name == "PNG":
+        return ["ZLEVEL=%d" % level]
+    if driver_name == "JPEG":
+        return ["QUALITY=%d" % jpeg_quality(level)]
+    if driver_name != "GTiff":
+        return []
+
+    compression = compression.upper()
+    if compression not in gtiff_compressions() or (
+        compression == "JPEG" and not is_jpeg_compatible(datatype, nbands)
+    ):
+        compression = "DEFLATE"
+    options = [
+        "TILED=YES",
+        "BLOCKXSIZE=%d" % GEOTIFF_BLOCK_SIZE,
+        "BLOCKYSIZE=%d" % GEOTIFF_BLOCK_SIZE,
+        "BIGTIFF=IF_SAFER",
+        "COMPRESS=%s" % compression,
+        # tiles compressed in parallel
+        "NUM_THREADS=ALL_CPUS",
+    ]
+    if compression in ("DEFLATE", "ZSTD", "LZW"):
+        # horizontal differencing, floating point one for floats
+        predictor = 3 if datatype.startswith("Float") else 2
+        options.append("PREDICTOR=%d" % predictor)
+    if compression == "DEFLATE":
+        options.append("ZLEVEL=%d" % level)
+    elif compression == "ZSTD":
+        options.append("ZSTD_LEVEL=%d" % (2 * level - 1))
+    elif compression == "JPEG":
+        options.append("JPEG_QUALITY=%d" % jpeg_quality(level))
+        if nbands == 3:
+            options.append("PHOTOMETRIC=YCBCR")
+    return options
+
+
+def georeferenced_vrt(
+    filepath, geotransform, wkt, band_indexes=None, byte_ranges=None, path=None
+):
+    """
+    VRT of the raster with another georeferencing (no pixel copied), written
+    to path or in memory (to be removed with gdal.Unlink). byte_ranges:
+    (min, max) of each band, stretched to Byte (see band_range). Returns the
+    path of the VRT
+    """
+    if path is None:
+        path = "/vsimem/%s.vrt" % uuid.uuid4().hex
+    options = {"format": "VRT", "bandList": band_indexes}
+    if byte_ranges is not None:
+        # as displayed (see to_byte: constant bands to 0)
+        options.update(
+            outputType=gdal.GDT_Byte,
+            scaleParams=[
+                [min_, max(max_, min_ + 1), 0, 255] for min_, max_ in byte_ranges
+            ],
+        )
+    dataset = gdal.Translate(path, filepath, **options)
+    if dataset is None:
+        raise RuntimeError(gdal.GetLastErrorMsg())
+    dataset.SetGeoTransform(geotransform)
+    dataset.SetProjection(wkt)
+    # written when closed
+    dataset = None
+    return path
+
+
+def export_raster(
+    filepath,
+    dst_path,
+    driver_name,
+    geotransform,
+    wkt,
+    pixel_size=None,
+    band_indexes=None,
+    alpha=False,
+    progress=None,
+    compression="DEFLATE",
+    level=6,
+    overviews=False,
+    percent_clip=0,
+):
+    """
+    Writes the raster georeferenced with geotransform to dst_path, block by
+    block so the memory used is bounded whatever the size of the raster. The
+    bands and their data type are kept if the driver supports them (stretched
+    to Byte as displayed otherwise, with percent_clip). Warped to a north up
+    raster of square pixels of pixel_size if given (with an alpha band if
+    alpha), copied as is otherwise. Compressed with compression (GeoTIFF) and level (see
+    creation_options), GeoTIFF with internal overviews if overviews.
+    progress is called with the completed fraction and returns False to
+    cancel. Returns the geotransform of the output, None if cancelled
+    """
+    driver = gdal.GetDriverByName(driver_name)
+    datatypes = (driver.GetMetadataItem(gdal.DMD_CREATIONDATATYPES) or "").split()
+    dataset = gdal.Open(filepath, gdal.GA_ReadOnly)
+    datatype = gdal.GetDataTypeName(dataset.GetRasterBand(1).DataType)
+    byte_ranges = None
+    if datatype not in datatypes:
+        byte_ranges = [
+            band_range(dataset.GetRasterBand(band_index), percent_clip)
+            for band_index in band_indexes or range(1, dataset.RasterCount + 1)
+        ]
+    dataset = None
+
+    src_path = georeferenced_vrt(filepath, geotransform, wkt, band_indexes, byte_ranges)
+    warped_path = None
+    try:
+        if pixel_size is not None:
+            # lazy: the pixels are warped while the output is written
+            warped_path = "/vsimem/%s.vrt" % uuid.uuid4().hex
+            warped = gdal.Warp(
+                warped_path,
+                src_path,
+                format="VRT",
+                xRes=pixel_size,
+                yRes=pixel_size,
+                dstAlpha=alpha,
+                resampleAlg="bilinear",
+                warpMemoryLimit=WARP_MEMORY,
+                multithread=True,
+            )
+            if warped is None:
+                raise RuntimeError(gdal.GetLastErrorMsg())
+            warped = None
+        source = gdal.Open(warped_path or src_path, gdal.GA_ReadOnly)
+        output_geotransform = source.GetGeoTransform()
+        if not _write_output(
+            source, dst_path, driver_name, compression, level, overviews, progress
+        ):
+            return None
+        return output_geotransform
+    finally:
+        gdal.Unlink(src_path)
+        if warped_path is not None:
+            gdal.Unlink(warped_path)
+
+
+def _write_output(
+    source, dst_path, driver_name, compression, level, overviews, progress
+):
+    # False if cancelled
+    options = creation_options(
+        driver_name,
+        compression,
+        level,
+        gdal.GetDataTypeName(source.GetRasterBand(1).DataType),
+        source.RasterCount,
+    )
+    overviews = overviews and driver_name == "GTiff"
+
+    cancelled = []
+    # part of the progress for the copy of the pixels
+    copy_part = 0.8 if overviews else 1.0
+
+    def stage_progress(start, part):
+        def stage(complete):
+            if progress is None or progress(start + part * complete):
+                return True
+            cancelled.append(True)
+            return False
+
+        return stage
+
+    _remove_stale_sidecars(dst_path, driver_name)
+    copy_progress = stage_progress(0.0, copy_part)
+    written = False
+    try:
+        output = gdal.Translate(
+            dst_path,
+            source,
+            format=driver_name,
+            creationOptions=options,
+            callback=lambda complete, message, data: int(copy_progress(complete)),
+        )
+        if output is not None and overviews:
+            # internal, from the written pixels
+            output = None
+            output = gdal.Open(dst_path, gdal.GA_Update)
+            if output is not None and not _build_overviews(
+                output, stage_progress(copy_part, 1.0 - copy_part)
+            ):
+                output = None
+        if output is None:
+            if cancelled:
+                return False
+            raise RuntimeError(gdal.GetLastErrorMsg())
+        # flushed
+        output = None
+        written = True
+        return True
+    finally:
+        if not written and os.path.exists(dst_path):
+            # incomplete
+            os.remove(dst_path)
+
+
+def _remove_stale_sidecars(dst_path, driver_name):
+    # of a previous export to the same path: conflict with the new
+    # georeferencing (the world file of other formats is written again)
+    paths = [dst_path + ".aux.xml"]
+    if driver_name == "GTiff":
+        root, _ = os.path.splitext(dst_path)
+        paths += [root + extension for extension in GTIFF_STALE_SIDECARS]
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def export_pixels(
+    pixels,
+    dst_path,
+    driver_name,
+    geotransform,
+    wkt,
+    progress=None,
+    compression="DEFLATE",
+    level=6,
+    overviews=False,
+):
+    """
+    Writes Byte pixels of shape (rows, cols, nbands), RGB(A) or gray, like
+    export_raster. Returns False if cancelled
+    """
+    rows, cols, nbands = pixels.shape
+    dataset = gdal.GetDriverByName("MEM").Create("", cols, rows, nbands, gdal.GDT_Byte)
+    dataset.SetGeoTransform(geotransform)
+    dataset.SetProjection(wkt)
+    for i in range(nbands):
+        band = dataset.GetRasterBand(i + 1)
+        band.WriteArray(pixels[..., i])
+        if nbands in (2, 4) and i == nbands - 1:
+            band.SetColorInterpretation(gdal.GCI_AlphaBand)
+    return _write_output(
+        dataset, dst_path, driver_name, compression, level, overviews, progress
+    )
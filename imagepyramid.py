@@ -0,0 +1,131 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import math
+import threading
+
+from PyQt5.QtCore import QRectF, Qt
+
+
+def levelIndexForScale(scale):
+    # scale is the number of screen pixels for 1 pixel of the image
+    # choose the smallest level that still has at least 1 pixel per screen
+    # pixel (level n is 2^n smaller than the image)
+    if scale <= 0 or scale >= 0.5:
+        return 0
+    return int(math.floor(math.log2(1.0 / scale)))
+
+
+class ImagePyramid:
+    """
+    Mip-style pyramid of an image: each level is half the size of the
+    previous one. Levels are computed on demand and kept for later draws.
+    Can be drawn from several threads.
+    """
+
+    # do not downsample below that size (in pixels, largest dimension)
+    MIN_SIZE = 256
+
+    def __init__(self, image, width=None, height=None):
+        # width and height of the full resolution image if image is a
+        # downsampled version
+        self.levels = [image]
+        self.lock = threading.Lock()
+        self._width = image.width() if width is None else width
+        self._height = image.height() if height is None else height
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def byteCount(self):
+        # of the computed levels
+        return sum(level.byteCount() for level in self.levels)
+
+    def level(self, index):
+        with self.lock:
+            return self._level(index)
+
+    def _level(self, index):
+        while len(self.levels) <= index:
+            previous = self.levels[-1]
+            if previous.isNull() or (
+                max(previous.width(), previous.height()) < 2 * self.MIN_SIZE
+            ):
+                # smallest level reached
+                break
+            self.levels.append(
+                previous.scaled(
+                    max(1, previous.width() // 2),
+                    max(1, previous.height() // 2),
+                    Qt.IgnoreAspectRatio,
+                    Qt.SmoothTransformation,
+                )
+            )
+        return self.levels[min(index, len(self.levels) - 1)]
+
+    def computedSmallestLevel(self):
+        """
+        Smallest level if already computed and downsampled from the image,
+        None otherwise (not computed here)
+        """
+        with self.lock:
+            level = self.levels[-1]
+            if len(self.levels) == 1 or (
+                max(level.width(), level.height()) >= 2 * self.MIN_SIZE
+            ):
+                return None
+            return level
+
+    def imageForScale(self, scale):
+        return self.level(levelIndexForScale(scale))
+
+    def draw(self, painter, rect, scale, isCancelled=None):
+        """
+        Draws the rect (in pixels of the full resolution image, None for all
+        of it) of the image on the painter, with the image top left corner at
+        (0, 0) and 1 unit per full resolution pixel. isCancelled returns True
+        if the drawing is not needed anymore
+        """
+        image = self.imageForScale(scale)
+        if image.isNull() or (isCancelled is not None and isCancelled()):
+            # a new level can take a while to compute
+            return
+
+        width = self.width()
+        height = self.height()
+        if rect is None:
+            painter.drawImage(QRectF(0, 0, width, height), image)
+            return
+        if rect.isEmpty():
+            return
+
+        factorX = image.width() / width
+        factorY = image.height() / height
+        # to level pixels with 1 pixel margin for the smoothing at the
+        # borders
+        left = max(0, math.floor(rect.left() * factorX) - 1)
+        top = max(0, math.floor(rect.top() * factorY) - 1)
+        right = min(image.width(), math.ceil(rect.right() * factorX) + 1)
+        bottom = min(image.height(), math.ceil(rect.bottom() * factorY) + 1)
+        if right <= left or bottom <= top:
+            return
+
+        sourceRect = QRectF(left, top, right - left, bottom - top)
+        targetRect = QRectF(
+            left / factorX,
+            top / factorY,
+            (right - left) / factorX,
+            (bottom - top) / factorY,
+        )
+        painter.drawImage(targetRect, image, sourceRect)
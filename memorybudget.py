@@ -0,0 +1,77 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from qgis.core import QgsProject
+
+from . import utils
+
+
+class MemoryBudget:
+    """
+    Limit of the memory used by the decoded pixels of all the plugin layers
+    (images in memory-mapped files are not counted: the OS can page them
+    out). Above it, the pixels of the hidden layers, then of the least
+    recently drawn layers, are freed. Enforced when a raster is loaded and
+    after the renders (levels and tiles read when drawn).
+
+    From the QGIS Python console:
+        budget = qgis.utils.plugins["FreehandRasterGeoreferencer"].memoryBudget
+        budget.maxBytes(), budget.totalBytes(), budget.usage()
+    """
+
+    def __init__(self, layers):
+        # layer id => layer, shared with the plugin
+        self.layers = layers
+
+    def maxBytes(self):
+        # 0 if no limit
+        return (
+            utils.settingValue(utils.SETTING_MEMORY_BUDGET, utils.DEFAULT_MEMORY_BUDGET)
+            * 1024
+            * 1024
+        )
+
+    def usage(self):
+        # layer id => bytes
+        return {layerId: layer.memoryUsage() for layerId, layer in self.layers.items()}
+
+    def totalBytes(self):
+        return sum(layer.memoryUsage() for layer in self.layers.values())
+
+    def enforce(self, keep=None):
+        """
+        Frees pixels until under the budget, except the ones of the keep
+        layer (just loaded)
+        """
+        maxBytes = self.maxBytes()
+        if maxBytes <= 0:
+            return
+        total = self.totalBytes()
+        if total <= maxBytes:
+            return
+
+        root = QgsProject.instance().layerTreeRoot()
+
+        def evictionOrder(layer):
+            node = root.findLayer(layer.id())
+            visible = node is not None and node.isVisible()
+            return (visible, layer.lastDrawn)
+
+        # nothing freed for the layers in memory-mapped files
+        layers = [
+            layer
+            for layer in self.layers.values()
+            if layer is not keep and layer.memoryUsage() > 0
+        ]
+        for layer in sorted(layers, key=evictionOrder):
+            if total <= maxBytes:
+                break
+            total -= layer.unloadPixels()
@@ -9,8 +9,9 @@
  ***************************************************************************/
 """
 
-from PyQt5.QtWidgets import QDialog
+from PyQt5.QtWidgets import QDialog, QMessageBox
 
+from . import utils
 from .ui_propertiesdialog import Ui_Dialog
 
 
@@ -27,6 +28,8 @@ class PropertiesDialog(QDialog, Ui_Dialog):
 
         self.textEdit_Properties.setText(layer.metadata())
         self.spinBox_Transparency.setValue(layer.transparency)
+        if layer.bands:
+            self.lineEdit_Bands.setText(",".join(str(band) for band in layer.bands))
 
     def sliderChanged(self, val):
         s = self.spinBox_Transparency
@@ -39,3 +42,34 @@ class PropertiesDialog(QDialog, Ui_Dialog):
         s.blockSignals(True)
         s.setValue(val)
         s.blockSignals(False)
+
+    def accept(self):
+        result, message, details = self.validate()
+        if result:
+            self.done(QDialog.Accepted)
+        else:
+            msgBox = QMessageBox()
+            msgBox.setWindowTitle("Error")
+            msgBox.setText(message)
+            msgBox.setDetailedText(details)
+            msgBox.setStandardButtons(QMessageBox.Ok)
+            msgBox.exec_()
+
+    def validate(self):
+        result = True
+        message = ""
+        details = ""
+
+        bandsText = self.lineEdit_Bands.text().strip()
+        if bandsText:
+            self.bands = utils.parseBands(bandsText)
+            if self.bands is None:
+                result = False
+                details += "Bands must be 3 band numbers (RGB) or 1 (gray)"
+        else:
+            self.bands = None
+
+        if not result:
+            message = "There were errors in the form"
+
+        return result, message, details
@@ -0,0 +1,292 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+
+import numpy as np
+from PyQt5.QtCore import QSettings, QSize
+from PyQt5.QtGui import QImage, QImageReader
+from qgis.core import QgsRasterLayer
+
+from . import gdal_utils, utils
+from .decodedcache import decodedCacheFromSettings
+from .imagepyramid import ImagePyramid
+from .tiledimagesource import TiledImageSource
+
+# rasters with overviews are read by tiles from that fraction of
+# tiledMinPixels: smaller ones are loaded in full (decoded cache,
+# memory-mapped file)
+OVERVIEWS_TILED_RATIO = 0.25
+
+
+class LoadOptions:
+    """
+    Parameters for the loading of a raster: read in the main thread, since
+    the loading itself can run in a background task
+    """
+
+    def __init__(self, bands=None):
+        # None for default bands
+        self.bands = bands
+        self.percentClip = utils.settingValue(
+            utils.SETTING_PERCENT_CLIP, utils.DEFAULT_PERCENT_CLIP
+        )
+        self.tiledMinPixels = utils.settingValue(
+            utils.SETTING_TILED_MIN_PIXELS, utils.DEFAULT_TILED_MIN_PIXELS
+        )
+        # in bytes
+        self.tileCacheSize = (
+            utils.settingValue(
+                utils.SETTING_TILE_CACHE_SIZE, utils.DEFAULT_TILE_CACHE_SIZE
+            )
+            * 1024
+            * 1024
+        )
+        # in bytes, 0 if not enabled
+        self.mappedMinSize = (
+            utils.settingValue(
+                utils.SETTING_MAPPED_MIN_SIZE, utils.DEFAULT_MAPPED_MIN_SIZE
+            )
+            * 1024
+            * 1024
+        )
+        # None if not enabled
+        self.decodedCache = decodedCacheFromSettings()
+
+
+class LoadedRaster:
+    """
+    Result of the loading: source for drawing (pyramid of the image or tiles
+    read when needed) and image if fully loaded in memory
+    """
+
+    def __init__(self, source, image=None, imageBuffer=None, isTransformed=False):
+        self.source = source
+        self.image = image
+        # pixels of image if not owned by it
+        self.imageBuffer = imageBuffer
+        # if pixels are not displayed as in the file
+        self.isTransformed = isTransformed
+
+    def mappedBytes(self):
+        # size of the image in a memory-mapped file
+        if isinstance(self.imageBuffer, np.memmap):
+            return self.imageBuffer.nbytes
+        return 0
+
+
+def displayedBands(bands, nbands):
+    """
+    Bands of the raster displayed as RGB (3 bands) or gray (1 band)
+    """
+    if bands and all(band <= nbands for band in bands):
+        return list(bands)
+    # by default first 3 bands or band 1 (band 2 ignored if 2 bands)
+    return [1, 2, 3] if nbands >= 3 else [1]
+
+
+def imageSize(filepath):
+    """
+    Size of the raster (width, height), read without decoding the pixels.
+    None if it cannot be known that way
+    """
+    if utils.imageFormat(filepath) == "tif":
+        format_ = gdal_utils.format(filepath)
+        if format_ is None:
+            return None
+        _, _, width, height = format_
+        return width, height
+
+    size = QImageReader(filepath).size()
+    if not size.isValid():
+        return None
+    return size.width(), size.height()
+
+
+def loadPdf(filepath):
+    # uses a QGIS layer: main thread only
+    s = QSettings()
+    oldValidation = s.value("/Projections/defaultBehavior")
+    s.setValue("/Projections/defaultBehavior", "useGlobal")  # for not asking about crs
+    layer = QgsRasterLayer(filepath, os.path.basename(filepath))
+    image = layer.previewAsImage(QSize(layer.width(), layer.height()))
+    s.setValue("/Projections/defaultBehavior", oldValidation)
+    return LoadedRaster(ImagePyramid(image), image)
+
+
+def loadRaster(task, filepath, options):
+    """
+    Decodes the raster (other than PDF) in a background task. Returns None if
+    the task is cancelled (superseded by another loading)
+    """
+
+    def isCancelled():
+        return task is not None and task.isCanceled()
+
+    cache = options.decodedCache
+    if cache is not None and not isTiled(filepath, options):
+        cached = cache.get(filepath, options)
+        if cached is not None:
+            image, buffer, isTransformed = cached
+            return LoadedRaster(ImagePyramid(image), image, buffer, isTransformed)
+
+    if isCancelled():
+        return None
+    loaded = decodeRaster(filepath, options, isCancelled)
+    if loaded is None or isCancelled():
+        return None
+    if loaded.image is None:
+        return loaded
+    if cache is not None:
+        cache.put(filepath, options, loaded.image, loaded.isTransformed)
+    if isMapped(loaded.image.byteCount(), options) and loaded.mappedBytes() == 0:
+        loaded = mappedRaster(loaded, filepath, options)
+    return loaded
+
+
+def isMapped(byteCount, options):
+    return 0 < options.mappedMinSize <= byteCount
+
+
+def mappedRaster(loaded, filepath, options):
+    """
+    Same raster with the pixels in the cache entry (memory-mapped), if any.
+    Not copied to a temporary file otherwise: the rasters decoded by Qt stay
+    on the heap (only the TIFF read by GDAL are decoded directly into a
+    memory-mapped file)
+    """
+    cache = options.decodedCache
+    if cache is not None:
+        cached = cache.get(filepath, options)
+        if cached is not None:
+            image, buffer, isTransformed = cached
+            return LoadedRaster(ImagePyramid(image), image, buffer, isTransformed)
+    return loaded
+
+
+def isTiled(filepath, options):
+    # too large to be loaded in full, or large with overviews for the lower
+    # resolutions (used by GDAL when reading tiles). Tiled rasters are not in
+    # the decoded cache nor memory-mapped
+    if utils.imageFormat(filepath) != "tif":
+        return False
+    format_ = gdal_utils.format(filepath)
+    if format_ is None:
+        return False
+    _, _, width, height = format_
+    pixels = width * height
+    if pixels >= options.tiledMinPixels:
+        return True
+    return (
+        pixels >= options.tiledMinPixels * OVERVIEWS_TILED_RATIO
+        and gdal_utils.overview_count(filepath) > 0
+    )
+
+
+def decodeRaster(filepath, options, isCancelled=None):
+    # None if cancelled
+    format_ = None
+    if utils.imageFormat(filepath) == "tif":
+        format_ = gdal_utils.format(filepath)
+    if format_ is not None:
+        nbands, datatype, width, height = format_
+        bandIndexes = displayedBands(options.bands, nbands)
+
+        if isTiled(filepath, options):
+            source = TiledImageSource(
+                filepath, options.tileCacheSize, options.percentClip, bandIndexes
+            )
+            return LoadedRaster(source, isTransformed=source.isTransformed())
+
+        # directly into a memory-mapped file if large
+        mapped = isMapped(width * height * len(bandIndexes), options)
+        if datatype != "Byte" or bandIndexes != list(range(1, nbands + 1)):
+            # cannot be read by Qt as is
+            return loadTransformedTiff(
+                filepath,
+                bandIndexes,
+                options.percentClip,
+                width,
+                height,
+                mapped,
+                isCancelled,
+            )
+        if mapped and gdal_utils.is_plain_byte(filepath):
+            # by GDAL rather than Qt, which decodes on the heap
+            return loadTransformedTiff(
+                filepath,
+                bandIndexes,
+                options.percentClip,
+                width,
+                height,
+                mapped,
+                isCancelled,
+                isTransformed=False,
+            )
+
+    # other than TIFF (or not read by GDAL) => assumes can be loaded by Qt
+    reader = QImageReader(filepath)
+    image = reader.read()
+    if image.isNull():
+        raise RuntimeError("%s: %s" % (filepath, reader.errorString()))
+    return LoadedRaster(ImagePyramid(image), image)
+
+
+def buildOverviews(task, filepath):
+    """
+    Builds the external overviews of a TIFF raster in a background task.
+    Returns False if cancelled, raises if failed (reported by the task)
+    """
+
+    def progress(complete):
+        task.setProgress(100 * complete)
+        return not task.isCanceled()
+
+    built = False
+    try:
+        built = gdal_utils.build_overviews(filepath, progress)
+    finally:
+        ovrPath = filepath + ".ovr"
+        if not built and os.path.exists(ovrPath):
+            # incomplete
+            os.remove(ovrPath)
+    return built
+
+
+def loadTransformedTiff(
+    filepath,
+    bandIndexes,
+    percentClip,
+    width,
+    height,
+    mapped=False,
+    isCancelled=None,
+    isTransformed=True,
+):
+    # only the displayed bands are read, converted by blocks of the file
+    # if not Byte, directly into the buffer of the image. None if cancelled
+    # isTransformed False for Byte gray or RGB (displayed as is)
+    pixels = gdal_utils.display_pixels(
+        filepath, bandIndexes, percentClip, mapped, isCancelled
+    )
+    if pixels is None:
+        return None
+    buffer, bytesPerLine = pixels
+
+    if len(bandIndexes) == 1:
+        # monochrome
+        format = QImage.Format_Grayscale8
+    else:
+        format = QImage.Format_RGB888
+
+    image = QImage(buffer, width, height, bytesPerLine, format)
+    # the QImage does not own the buffer
+    return LoadedRaster(ImagePyramid(image), image, buffer, isTransformed)
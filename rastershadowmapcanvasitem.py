@@ -9,22 +9,32 @@
  ***************************************************************************/
 """
 
-from PyQt5.QtCore import QPointF, QRectF
-from PyQt5.QtGui import QPainter
+from PyQt5.QtCore import QRectF, Qt
+from PyQt5.QtGui import QImage, QPainter
 from qgis.core import QgsPointXY, QgsRectangle
 from qgis.gui import QgsMapCanvasItem
 
 
 class RasterShadowMapCanvasItem(QgsMapCanvasItem):
+    # largest side of the proxy image, relative to the largest side of the
+    # canvas
+    PROXY_MAX_CANVAS_RATIO = 2
+
     def __init__(self, canvas):
         QgsMapCanvasItem.__init__(self, canvas)
 
         self.canvas = canvas
+        # downsampled image of the layer drawn during the gesture
+        self.proxy = None
+        self.proxyKey = None
         self.reset()
 
     def reset(self, layer=None):
+        # called with the layer on each move of the gesture, without at the
+        # end
         self.layer = layer
         self.setVisible(False)
+        self.updateProxy()
 
         self.dx = 0
         self.dy = 0
@@ -38,27 +48,55 @@ class RasterShadowMapCanvasItem(QgsMapCanvasItem):
         if doUpdate:
             self.setVisible(self.layer is None)
             self.updateRect()
-            self.update()
 
     def setDeltaRotation(self, rotation, doUpdate):
         self.drotation = rotation
         if doUpdate:
             self.updateRect()
-            self.update()
 
     def setDeltaRotationFromPoint(self, rotation, startPoint, doUpdate):
         # Rotation around a point other than center of raster
         self.drotation = rotation
         if doUpdate:
             self.updateRectFromPoint(startPoint)
-            self.update()
 
     def setDeltaScale(self, xscale, yscale, doUpdate):
         self.fxscale = xscale
         self.fyscale = yscale
         if doUpdate:
             self.updateRect()
-            self.update()
+
+    def updateProxy(self):
+        if self.layer is None or self.layer.source is None:
+            self.proxy = self.proxyKey = None
+            return
+
+        # built again only if the layer or the map scale changes
+        mapUPerPixel = self.canvas.mapUnitsPerPixel()
+        key = (self.layer.id(), self.layer.source, mapUPerPixel)
+        if key == self.proxyKey:
+            return
+        self.proxyKey = key
+
+        # canvas resolution, bounded by the size of the canvas
+        width = self.layer.imageWidth
+        height = self.layer.imageHeight
+        canvasSize = max(self.canvas.width(), self.canvas.height())
+        factor = min(
+            1.0,
+            max(abs(self.layer.xScale), abs(self.layer.yScale)) / mapUPerPixel,
+            self.PROXY_MAX_CANVAS_RATIO * canvasSize / max(width, height),
+        )
+        proxyWidth = max(1, int(round(width * factor)))
+        proxyHeight = max(1, int(round(height * factor)))
+
+        self.proxy = QImage(proxyWidth, proxyHeight, QImage.Format_ARGB32_Premultiplied)
+        self.proxy.fill(Qt.transparent)
+        painter = QPainter(self.proxy)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, True)
+        painter.scale(proxyWidth / width, proxyHeight / height)
+        self.layer.source.draw(painter, None, factor)
+        painter.end()
 
     def updateRect(self):
         topLeft, topRight, bottomRight, bottomLeft = self.cornerCoordinates()
@@ -105,15 +143,15 @@ class RasterShadowMapCanvasItem(QgsMapCanvasItem):
         painter.restore()
 
     def drawRaster(self, painter):
+        if self.proxy is None:
+            # still loading
+            return
+
         mapUPerPixel = self.canvas.mapUnitsPerPixel()
 
         scaleX = self.layer.xScale * self.fxscale / mapUPerPixel
         scaleY = self.layer.yScale * self.fyscale / mapUPerPixel
 
-        rect = QRectF(
-            QPointF(-self.layer.image.width() / 2.0, -self.layer.image.height() / 2.0),
-            QPointF(self.layer.image.width() / 2.0, self.layer.image.height() / 2.0),
-        )
         targetRect = self.boundingRect()
 
         painter.setRenderHint(QPainter.SmoothPixmapTransform, True)
@@ -124,7 +162,11 @@ class RasterShadowMapCanvasItem(QgsMapCanvasItem):
         painter.translate(targetRect.center())
         painter.rotate(self.layer.rotation + self.drotation)
         painter.scale(scaleX, scaleY)
-        painter.drawImage(rect, self.layer.image)
+        painter.translate(-self.layer.imageWidth / 2.0, -self.layer.imageHeight / 2.0)
+        # whatever the size of the raster: proxy at most the size of the canvas
+        painter.drawImage(
+            QRectF(0, 0, self.layer.imageWidth, self.layer.imageHeight), self.proxy
+        )
 
     def prepareStyle(self, painter):
         painter.setOpacity(min(0.5, 1 - self.layer.transparency / 100.0))
@@ -0,0 +1,80 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import numpy as np
+import pytest
+
+from ..affinetransform import AffineTransform
+
+
+def test_identity():
+    assert AffineTransform().coefficients() == (1.0, 0.0, 0.0, 0.0, 1.0, 0.0)
+
+
+def test_geotransform_round_trip():
+    geoTransform = (440720.0, 60.0, 0.5, 3751320.0, -0.25, -60.0)
+    transform = AffineTransform.fromGeoTransform(geoTransform)
+    assert transform.coefficients() == (60.0, 0.5, 440720.0, -0.25, -60.0, 3751320.0)
+    assert transform.geoTransform() == geoTransform
+
+
+def test_compose_applies_right_first():
+    translation = AffineTransform.translation(10.0, 20.0)
+    scaling = AffineTransform.scaling(2.0, 3.0)
+    assert (translation @ scaling).transformPoint(1.0, 1.0) == (12.0, 23.0)
+    assert translation.compose(scaling).transformPoint(1.0, 1.0) == (12.0, 23.0)
+    assert (scaling @ translation).transformPoint(1.0, 1.0) == (22.0, 63.0)
+
+
+def test_rotation_counterclockwise():
+    x, y = AffineTransform.rotation(90.0).transformPoint(1.0, 0.0)
+    assert x == pytest.approx(0.0, abs=1e-12)
+    assert y == pytest.approx(1.0)
+
+
+def test_inverted():
+    transform = (
+        AffineTransform.translation(5.0, -3.0)
+        @ AffineTransform.rotation(30.0)
+        @ AffineTransform.scaling(2.0, -0.5)
+    )
+    identity = transform @ transform.inverted()
+    np.testing.assert_allclose(identity.matrix, np.identity(3), atol=1e-12)
+    x, y = transform.transformPoint(7.0, 11.0)
+    np.testing.assert_allclose(transform.inverted().transformPoint(x, y), (7.0, 11.0))
+
+
+def test_transform_points_matches_transform_point():
+    transform = AffineTransform.fromCoefficients(2.0, 0.5, 10.0, -0.25, -3.0, 20.0)
+    points = np.array([[0.0, 0.0], [1.0, 2.0], [-4.5, 3.25]])
+    transformed = transform.transformPoints(points)
+    assert transformed.shape == (3, 2)
+    for point, expected in zip(points, transformed):
+        np.testing.assert_allclose(transform.transformPoint(*point), expected)
+
+
+def test_world_file_references_the_center_of_the_pixels():
+    # pixel corner transform: 2 map units per pixel, north up
+    transform = AffineTransform.fromGeoTransform((1000.0, 2.0, 0.0, 5000.0, 0.0, -2.0))
+    a, d, b, e, c, f = transform.worldFile()
+    assert (a, d, b, e) == (2.0, 0.0, 0.0, -2.0)
+    # center of the top left pixel
+    assert (c, f) == (1001.0, 4999.0)
+
+
+def test_world_file_with_rotation():
+    transform = AffineTransform.rotation(30.0) @ AffineTransform.scaling(2.0, -2.0)
+    a, d, b, e, c, f = transform.worldFile()
+    np.testing.assert_allclose((c, f), transform.transformPoint(0.5, 0.5), atol=1e-12)
+    linear = transform.coefficients()
+    np.testing.assert_allclose(
+        (a, b, d, e), (linear[0], linear[1], linear[3], linear[4])
+    )
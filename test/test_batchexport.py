@@ -0,0 +1,106 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+
+import pytest
+
+pytest.importorskip("qgis")
+
+from .. import batchexport, gdal_utils, utils  # noqa: E402
+
+
+class Layer:
+    # what outputName uses of a plugin layer
+    def __init__(self, name, filepath):
+        self._name = name
+        self.filepath = filepath
+
+    def name(self):
+        return self._name
+
+
+def test_output_name_default_template():
+    layer = Layer("Map 1", "scans/map_1.jpg")
+    assert (
+        batchexport.outputName(batchexport.DEFAULT_TEMPLATE, layer, 3)
+        == "map_1_georeferenced.tif"
+    )
+
+
+def test_output_name_fields():
+    layer = Layer("Map 1", "/data/map_1.tiff")
+    assert (
+        batchexport.outputName("{index:03d}_{name}_{file}.png", layer, 7)
+        == "007_Map 1_map_1.png"
+    )
+
+
+def test_output_name_replaces_illegal_characters():
+    layer = Layer('a/b:c*d?"e"<f>|g\\h', "x.tif")
+    assert batchexport.outputName("{name}.tif", layer, 1) == "a_b_c_d__e__f__g_h.tif"
+
+
+@pytest.mark.parametrize(
+    "template", ["{file}.tif", "{name}_{index}.png", "{index:04d}.jpg", "x.vrt"]
+)
+def test_valid_template(template):
+    assert batchexport.templateError(template) is None
+
+
+@pytest.mark.parametrize(
+    "template", ["{foo}.tif", "{name.tif", "name}.tif", "{}.tif", "{0}.tif"]
+)
+def test_invalid_template(template):
+    assert batchexport.templateError(template) is not None
+
+
+def test_unique_path_suffixes_collisions():
+    usedPaths = set()
+    path = os.path.join("out", "map.tif")
+    assert batchexport.uniquePath(path, 1, usedPaths) == path
+    assert batchexport.uniquePath(path, 2, usedPaths) == os.path.join(
+        "out", "map_2.tif"
+    )
+    assert batchexport.uniquePath(path, 3, usedPaths) == os.path.join(
+        "out", "map_3.tif"
+    )
+    # suffixed path already used by the name of another layer
+    assert batchexport.uniquePath(
+        os.path.join("out", "map_4.tif"), 4, usedPaths
+    ) == os.path.join("out", "map_4.tif")
+    assert batchexport.uniquePath(path, 4, usedPaths) == os.path.join(
+        "out", "map_4_4.tif"
+    )
+
+
+@pytest.mark.parametrize(
+    "cores, budget, expected",
+    [
+        (8, 0, 8),
+        (8, 4096, 8),
+        (8, 512, 512 * 1024 * 1024 // gdal_utils.WARP_MEMORY),
+        (8, 1, 1),
+        (None, 4096, 1),
+    ],
+)
+def test_max_running_exports(monkeypatch, cores, budget, expected):
+    monkeypatch.setattr(os, "cpu_count", lambda: cores)
+    monkeypatch.setattr(utils, "settingValue", lambda key, default: budget)
+    assert batchexport.maxRunningExports() == expected
+
+
+def test_failed_names():
+    failures = [("layer %d" % i, "error") for i in range(12)]
+    assert batchexport.failedNames(failures[:2]) == "layer 0, layer 1"
+    assert batchexport.failedNames(failures, maxNames=3) == (
+        "layer 0, layer 1, layer 2, ..."
+    )
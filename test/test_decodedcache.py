@@ -0,0 +1,124 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+
+import pytest
+
+pytest.importorskip("qgis")
+
+from PyQt5.QtGui import QColor, QImage  # noqa: E402
+
+from ..decodedcache import DecodedCache, EXTENSION, HEADER  # noqa: E402
+
+
+class Options:
+    # display options of rasterloader.LoadOptions used for the key
+    def __init__(self, bands=None, percentClip=0.0):
+        self.bands = bands
+        self.percentClip = percentClip
+
+
+@pytest.fixture
+def raster(tmp_path):
+    path = tmp_path / "raster.tif"
+    path.write_bytes(b"pixels")
+    return str(path)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DecodedCache(str(tmp_path / "cache"), 1024 * 1024)
+
+
+def test_same_key_for_same_raster_and_options(cache, raster):
+    assert cache.entryPath(raster, Options([1])) == cache.entryPath(
+        raster, Options([1])
+    )
+
+
+def test_key_depends_on_display_options(cache, raster):
+    paths = {
+        cache.entryPath(raster, Options()),
+        cache.entryPath(raster, Options([3, 2, 1])),
+        cache.entryPath(raster, Options(percentClip=2.0)),
+    }
+    assert len(paths) == 3
+
+
+def test_key_changes_when_raster_modified(cache, raster):
+    path = cache.entryPath(raster, Options())
+    stat = os.stat(raster)
+    os.utime(raster, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.entryPath(raster, Options()) != path
+
+
+def test_put_then_get(cache, raster):
+    image = QImage(5, 3, QImage.Format_RGB888)
+    image.fill(QColor(10, 20, 30))
+    cache.put(raster, Options(), image, True)
+
+    cached = cache.get(raster, Options())
+    assert cached is not None
+    cachedImage, buffer, isTransformed = cached
+    assert isTransformed
+    assert cachedImage.size() == image.size()
+    assert cachedImage.format() == image.format()
+    assert cachedImage.pixel(4, 2) == image.pixel(4, 2)
+    assert buffer.nbytes == image.byteCount()
+
+
+def test_get_missing(cache, raster):
+    assert cache.get(raster, Options()) is None
+
+
+def test_image_larger_than_cache_not_put(tmp_path, raster):
+    cache = DecodedCache(str(tmp_path / "cache"), 100)
+    image = QImage(100, 100, QImage.Format_Grayscale8)
+    image.fill(0)
+    cache.put(raster, Options(), image, False)
+    assert cache.get(raster, Options()) is None
+
+
+def test_truncated_entry_ignored(cache, raster):
+    image = QImage(8, 8, QImage.Format_Grayscale8)
+    image.fill(0)
+    cache.put(raster, Options(), image, False)
+    path = cache.entryPath(raster, Options())
+    with open(path, "r+b") as f:
+        f.truncate(HEADER.size + 10)
+    assert cache.get(raster, Options()) is None
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    directory = tmp_path / "cache"
+    directory.mkdir()
+    cache = DecodedCache(str(directory), 250)
+    for i, name in enumerate(["old", "middle", "recent"]):
+        path = directory / (name + EXTENSION)
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (1000 + i, 1000 + i))
+    other = directory / "other.txt"
+    other.write_bytes(b"x" * 1000)
+
+    cache.evict()
+
+    assert sorted(os.listdir(directory)) == sorted(
+        ["middle" + EXTENSION, "recent" + EXTENSION, "other.txt"]
+    )
+
+
+def test_clear(cache, raster):
+    image = QImage(4, 4, QImage.Format_Grayscale8)
+    image.fill(0)
+    cache.put(raster, Options(), image, False)
+    cache.clear()
+    assert cache.entries() == []
@@ -0,0 +1,98 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+
+from .. import gdal_utils  # noqa: E402
+
+
+class Band:
+    # values needed by band_range, without a dataset
+    def __init__(self, data):
+        self.data = np.asarray(data, dtype=np.float64)
+
+    def ComputeRasterMinMax(self, approx_ok):
+        return float(self.data.min()), float(self.data.max())
+
+    def GetHistogram(self, min_, max_, buckets, include_out_of_range, approx_ok):
+        histogram, _ = np.histogram(self.data, bins=buckets, range=(min_, max_))
+        return histogram.tolist()
+
+
+@pytest.mark.parametrize("dtype", ["uint16", "int16", "uint8", "int8"])
+def test_lut_covers_all_values(dtype):
+    lut, unsigned = gdal_utils._lut(np.dtype(dtype).str, 10.0, 100.0)
+    assert lut.dtype == np.uint8
+    assert lut.shape == (2 ** (8 * np.dtype(dtype).itemsize),)
+    assert unsigned == np.dtype("u%d" % np.dtype(dtype).itemsize)
+    values = [0, 10, 55, 100, 120]
+    if np.dtype(dtype).kind == "i":
+        values.append(-5)
+    values = np.array(values, dtype=dtype)
+    expected = 255.0 * (np.clip(values, 10, 100) - 10) / 90
+    np.testing.assert_array_equal(lut[values.view(unsigned)], expected.astype(np.uint8))
+
+
+def test_lut_is_cached():
+    dtype = np.dtype("uint16").str
+    assert gdal_utils._lut(dtype, 0.0, 1000.0) is gdal_utils._lut(dtype, 0.0, 1000.0)
+
+
+@pytest.mark.parametrize("dtype", ["uint16", "int16", "int32", "float32"])
+def test_to_byte_stretches_between_min_and_max(dtype):
+    data = np.array([[100, 200, 600], [1100, 2000, 350]], dtype=dtype)
+    result = gdal_utils.to_byte(data, 200, 1100)
+    assert result.dtype == np.uint8
+    np.testing.assert_array_equal(result, [[0, 0, 113], [255, 255, 42]])
+
+
+def test_to_byte_uses_the_range_of_the_data_by_default():
+    data = np.array([[10, 20], [30, 40]], dtype=np.uint16)
+    np.testing.assert_array_equal(gdal_utils.to_byte(data), [[0, 85], [170, 255]])
+
+
+def test_to_byte_constant_data():
+    data = np.full((3, 3), 7, dtype=np.float64)
+    np.testing.assert_array_equal(gdal_utils.to_byte(data), np.zeros((3, 3)))
+
+
+def test_to_byte_writes_into_out_by_chunks(monkeypatch):
+    monkeypatch.setattr(gdal_utils, "CHUNK_PIXELS", 8)
+    data = np.arange(40 * 4, dtype=np.float32).reshape((40, 4))
+    out = np.zeros((40, 4, 3), dtype=np.uint8)
+    result = gdal_utils.to_byte(data, 0, 159, out=out[..., 1])
+    expected = (255.0 * data / 159).astype(np.uint8)
+    np.testing.assert_array_equal(out[..., 1], expected)
+    np.testing.assert_array_equal(result, expected)
+    assert not out[..., 0].any() and not out[..., 2].any()
+
+
+def test_band_range_without_clip():
+    band = Band([3, 5, 8, 200])
+    assert gdal_utils.band_range(band) == (3.0, 200.0)
+
+
+def test_band_range_cuts_the_extreme_values():
+    # 1000 values, 1% cut on each side: the outliers are outside the range
+    band = Band([-5000.0] * 5 + list(np.linspace(0, 100, 990)) + [9000.0] * 5)
+    min_, max_ = gdal_utils.band_range(band, percent_clip=1)
+    # to the bucket of the histogram
+    bucket_width = 14000.0 / gdal_utils.HISTOGRAM_BUCKETS
+    assert -bucket_width < min_ <= bucket_width
+    assert 100.0 - bucket_width <= max_ < 100.0 + 2 * bucket_width
+
+
+def test_band_range_constant_band():
+    band = Band([4.0, 4.0, 4.0])
+    assert gdal_utils.band_range(band, percent_clip=2) == (4.0, 4.0)
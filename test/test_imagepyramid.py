@@ -0,0 +1,35 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import pytest
+
+pytest.importorskip("PyQt5")
+
+from ..imagepyramid import levelIndexForScale  # noqa: E402
+
+
+@pytest.mark.parametrize("scale", [0.5, 1.0, 4.0])
+def test_full_resolution_when_not_zoomed_out(scale):
+    assert levelIndexForScale(scale) == 0
+
+
+def test_full_resolution_for_invalid_scale():
+    assert levelIndexForScale(0) == 0
+    assert levelIndexForScale(-1.0) == 0
+
+
+@pytest.mark.parametrize(
+    "scale, index", [(0.25, 2), (0.3, 1), (0.125, 3), (0.1, 3), (1 / 1024, 10)]
+)
+def test_smallest_level_with_a_pixel_per_screen_pixel(scale, index):
+    assert levelIndexForScale(scale) == index
+    # level n is 2^n smaller
+    assert scale * 2**index <= 1.0
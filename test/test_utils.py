@@ -0,0 +1,35 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import pytest
+
+pytest.importorskip("qgis")
+
+from .. import utils  # noqa: E402
+
+
+@pytest.mark.parametrize(
+    "text, bands", [("1", [1]), ("4,3,2", [4, 3, 2]), (" 5, 3 ,6", [5, 3, 6])]
+)
+def test_parse_bands(text, bands):
+    assert utils.parseBands(text) == bands
+
+
+@pytest.mark.parametrize("text", ["", "a", "1,2", "1,2,3,4", "0", "3,-1,2", "1.5"])
+def test_parse_bands_invalid(text):
+    assert utils.parseBands(text) is None
+
+
+@pytest.mark.parametrize(
+    "size, text", [(0, "0.0 MB"), (512 * 1024, "0.5 MB"), (3 * 1024**3, "3072.0 MB")]
+)
+def test_format_bytes(size, text):
+    assert utils.formatBytes(size) == text
@@ -0,0 +1,191 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from collections import OrderedDict
+import math
+import threading
+
+from osgeo import gdal
+from PyQt5.QtCore import QRectF
+from PyQt5.QtGui import QImage
+
+from . import gdal_utils
+from .imagepyramid import levelIndexForScale
+
+
+class TiledImageSource:
+    """
+    Image read from a GDAL dataset by tiles, only when they are drawn. The
+    decoded tiles are kept in a LRU cache bounded in bytes.
+
+    Tile (col, row) of level n covers TILE_SIZE * 2^n pixels of the full
+    resolution image in each dimension, read into TILE_SIZE pixels.
+    """
+
+    TILE_SIZE = 512
+
+    def __init__(self, filepath, cacheSize, percentClip=0, bandIndexes=None):
+        # cacheSize in bytes
+        # bandIndexes: 3 bands displayed as RGB or 1 band displayed as gray
+        self.filepath = filepath
+        self.cacheSize = cacheSize
+
+        self.dataset = gdal.Open(filepath, gdal.GA_ReadOnly)
+        self._width = self.dataset.RasterXSize
+        self._height = self.dataset.RasterYSize
+
+        if bandIndexes is None:
+            # first 3 or band 1 (band 2 ignored if 2 bands)
+            bandIndexes = [1, 2, 3] if self.dataset.RasterCount >= 3 else [1]
+        self.bandIndexes = bandIndexes
+        if len(bandIndexes) == 3:
+            self.format = QImage.Format_RGB888
+        else:
+            self.format = QImage.Format_Grayscale8
+
+        self.ranges = []
+        for bandIndex in self.bandIndexes:
+            band = self.dataset.GetRasterBand(bandIndex)
+            if band.DataType == gdal.GDT_Byte:
+                self.ranges.append(None)
+            else:
+                self.ranges.append(gdal_utils.band_range(band, percentClip))
+
+        largestSize = max(self._width, self._height)
+        self.maxLevel = max(0, int(math.floor(math.log2(largestSize / self.TILE_SIZE))))
+
+        # GDAL datasets cannot be read from several threads at the same time
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.cachedBytes = 0
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def byteCount(self):
+        # of the cached tiles
+        return self.cachedBytes
+
+    def clearCache(self):
+        with self.lock:
+            self.cache.clear()
+            self.cachedBytes = 0
+
+    def isTransformed(self):
+        # if pixels are not displayed as in the file
+        allBands = list(range(1, self.dataset.RasterCount + 1))
+        return self.bandIndexes != allBands or any(
+            range_ is not None for range_ in self.ranges
+        )
+
+    def tileSpan(self, level):
+        # in full resolution pixels
+        return self.TILE_SIZE * 2**level
+
+    def tileRect(self, level, col, row):
+        span = self.tileSpan(level)
+        x = col * span
+        y = row * span
+        return QRectF(x, y, min(span, self._width - x), min(span, self._height - y))
+
+    def tile(self, level, col, row):
+        key = (level, col, row)
+        with self.lock:
+            image = self.cache.get(key)
+            if image is not None:
+                self.cache.move_to_end(key)
+                return image
+
+            image = self.readTile(level, col, row)
+
+            self.cache[key] = image
+            self.cachedBytes += image.byteCount()
+            while self.cachedBytes > self.cacheSize and len(self.cache) > 1:
+                _, evicted = self.cache.popitem(last=False)
+                self.cachedBytes -= evicted.byteCount()
+
+            return image
+
+    def readTile(self, level, col, row):
+        rect = self.tileRect(level, col, row)
+        xoff = int(rect.x())
+        yoff = int(rect.y())
+        xsize = int(rect.width())
+        ysize = int(rect.height())
+        factor = 2**level
+        bufXSize = max(1, int(math.ceil(xsize / factor)))
+        bufYSize = max(1, int(math.ceil(ysize / factor)))
+
+        buffer, bytesPerLine, pixels = gdal_utils.image_buffer(
+            bufYSize, bufXSize, len(self.bandIndexes)
+        )
+        for i, bandIndex in enumerate(self.bandIndexes):
+            band = self.dataset.GetRasterBand(bandIndex)
+            if self.ranges[i] is None:
+                # Byte: directly into the image buffer
+                band.ReadAsArray(
+                    xoff,
+                    yoff,
+                    xsize,
+                    ysize,
+                    bufXSize,
+                    bufYSize,
+                    buf_obj=pixels[..., i],
+                    resample_alg=gdal.GRIORA_Average,
+                )
+            else:
+                data = band.ReadAsArray(
+                    xoff,
+                    yoff,
+                    xsize,
+                    ysize,
+                    bufXSize,
+                    bufYSize,
+                    resample_alg=gdal.GRIORA_Average,
+                )
+                gdal_utils.to_byte(data, *self.ranges[i], out=pixels[..., i])
+
+        qImg = QImage(buffer, bufXSize, bufYSize, bytesPerLine, self.format)
+        # the QImage does not own the numpy buffer
+        return qImg.copy()
+
+    def draw(self, painter, rect, scale, isCancelled=None):
+        """
+        Draws the rect (in pixels of the full resolution image, None for all
+        of it) of the image on the painter, with the image top left corner at
+        (0, 0) and 1 unit per full resolution pixel. isCancelled returns True
+        if the drawing is not needed anymore
+        """
+        if rect is None:
+            rect = QRectF(0, 0, self._width, self._height)
+        if rect.isEmpty():
+            return
+
+        level = min(levelIndexForScale(scale), self.maxLevel)
+        span = self.tileSpan(level)
+        cols = int(math.ceil(self._width / span))
+        rows = int(math.ceil(self._height / span))
+        firstCol = max(0, int(rect.left() // span))
+        lastCol = min(cols - 1, int(rect.right() // span))
+        firstRow = max(0, int(rect.top() // span))
+        lastRow = min(rows - 1, int(rect.bottom() // span))
+
+        for row in range(firstRow, lastRow + 1):
+            for col in range(firstCol, lastCol + 1):
+                if isCancelled is not None and isCancelled():
+                    # before reading another tile
+                    return
+                painter.drawImage(
+                    self.tileRect(level, col, row), self.tile(level, col, row)
+                )
@@ -11,13 +11,56 @@
 
 import os.path
 
-from PyQt5.QtCore import qDebug
+from PyQt5.QtCore import qDebug, QSettings
 from qgis.core import QgsProject
 
 # constants for saving data inside QGS
 SETTINGS_KEY = "FreehandRasterGeoreferencer"
 SETTING_BROWSER_RASTER_DIR = "browseRasterDir"
 
+# constants for the plugin settings (QGIS user profile)
+# rasters with more pixels are read by tiles, when needed, instead of being
+# loaded in memory in full
+SETTING_TILED_MIN_PIXELS = "tiledMinPixels"
+DEFAULT_TILED_MIN_PIXELS = 100000000
+# in MB, for each tiled raster
+SETTING_TILE_CACHE_SIZE = "tileCacheSize"
+DEFAULT_TILE_CACHE_SIZE = 256
+# % of values cut on each side when stretching non-Byte rasters for display
+SETTING_PERCENT_CLIP = "percentClip"
+DEFAULT_PERCENT_CLIP = 0.0
+# in MB, TIFF rasters read by GDAL, loaded in full and larger are decoded
+# into a memory-mapped file that the OS can page out (other formats only if in
+# the decoded cache): 0 to disable
+SETTING_MAPPED_MIN_SIZE = "mappedMinSize"
+DEFAULT_MAPPED_MIN_SIZE = 512
+# in MB, for the pixels in memory of all the layers: 0 for no limit
+SETTING_MEMORY_BUDGET = "memoryBudget"
+DEFAULT_MEMORY_BUDGET = 4096
+# fast drawing (no smoothing, lower resolution) while the map is navigated
+# and for preview renders, smooth once settled
+SETTING_ADAPTIVE_QUALITY = "adaptiveQuality"
+DEFAULT_ADAPTIVE_QUALITY = True
+# directory of the decoded rasters kept between sessions: empty to disable
+SETTING_DECODED_CACHE_DIR = "decodedCacheDir"
+DEFAULT_DECODED_CACHE_DIR = ""
+# in MB
+SETTING_DECODED_CACHE_SIZE = "decodedCacheSize"
+DEFAULT_DECODED_CACHE_SIZE = 4096
+# of the exported GeoTIFF: DEFLATE, ZSTD, LZW, JPEG (Byte rasters only) or
+# NONE
+SETTING_EXPORT_COMPRESSION = "exportCompression"
+DEFAULT_EXPORT_COMPRESSION = "DEFLATE"
+# internal overviews in the exported GeoTIFF
+SETTING_EXPORT_OVERVIEWS = "exportOverviews"
+DEFAULT_EXPORT_OVERVIEWS = True
+# of the exported rasters, 1 (fastest) to 9 (smallest): compression level,
+# or quality for JPEG
+SETTING_EXPORT_LEVEL = "exportLevel"
+DEFAULT_EXPORT_LEVEL = 6
+# file name of the rasters exported in batch
+SETTING_EXPORT_TEMPLATE = "exportTemplate"
+
 
 def toRelativeToQGS(imagePath):
     qgsPath = QgsProject.instance().fileName()
@@ -37,6 +80,27 @@ def toRelativeToQGS(imagePath):
     return imagePath
 
 
+def settingValue(key, default):
+    return QSettings().value("%s/%s" % (SETTINGS_KEY, key), default, type=type(default))
+
+
+def setSettingValue(key, value):
+    QSettings().setValue("%s/%s" % (SETTINGS_KEY, key), value)
+
+
+def parseBands(text):
+    """
+    Bands displayed as RGB ("4,3,2") or gray ("1"). None if not valid
+    """
+    try:
+        bands = [int(band) for band in text.split(",")]
+    except ValueError:
+        return None
+    if len(bands) not in (1, 3) or any(band < 1 for band in bands):
+        return None
+    return bands
+
+
 def tryfloat(strF):
     try:
         f = float(strF)
@@ -45,6 +109,10 @@ def tryfloat(strF):
         return None
 
 
+def formatBytes(size):
+    return "%.1f MB" % (size / (1024 * 1024))
+
+
 def imageFormat(path):
     _, extension = os.path.splitext(path)
     extension = extension.lstrip(".").lower()